@@ -0,0 +1,261 @@
+# Build a large, reproducible dataset for scale testing.
+# Run from the repository root: python -m benchmarks.generate --db big.sqlite3 --users 1000000 --transactions 3000000
+# The schema comes from the models, rows go in through sqlite3 executemany with journaling
+# off and indexes rebuilt at the end, so a 10M row database takes a few minutes.
+# Completed and refunded transactions also get the ledger entries and report aggregates
+# that completing and refunding them through the API would have written.
+# The same seed gives the same rows; timestamps are relative to the time of the run.
+import argparse
+import asyncio
+import itertools
+import random
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+from tortoise import Tortoise
+from shopen.models.setup import migrate_version_columns
+from shopen.settings import TRANSACTION_REQUEST_THRESHOLD
+
+BRANDS = ['Pilot', 'Parker', 'Bic', 'Lamy', 'Kaweco', 'Faber-Castell', 'Sailor', 'Platinum',
+          'Waterman', 'Cross', 'Zebra', 'Uni-ball', 'Pentel', 'Staedtler', 'Montblanc']
+COLORS = ['blue', 'black', 'red', 'green', 'purple', 'orange', 'silver', None]
+STATUSES = (['completed'] * 70) + (['cancelled'] * 15) + (['refunded'] * 10) + (['requested'] * 5)
+CHUNK = 50_000
+
+
+def stamp(moment: datetime) -> str:
+    # the format tortoise writes for timezone-aware datetimes
+    return moment.isoformat(' ', timespec='microseconds')
+
+
+def zipf_weights(n: int, skew: float) -> list[float]:
+    # cumulative weights, rank 1 is the hottest; skew 0 is uniform
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, n + 1)))
+
+
+def chunks(rows: Iterator[tuple], size: int = CHUNK) -> Iterator[list[tuple]]:
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def insert(db: sqlite3.Connection, table: str, columns: tuple[str, ...], rows: Iterator[tuple]) -> int:
+    names = ', '.join(f'"{column}"' for column in columns)
+    sql = f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * len(columns))})'
+    started = time.perf_counter()
+    total = 0
+    for chunk in chunks(rows):
+        db.executemany(sql, chunk)
+        total += len(chunk)
+    db.commit()
+    elapsed = time.perf_counter() - started
+    print(f"{table:<16} {total:>12,} rows {total / max(elapsed, 1e-9):>12,.0f} rows/s")
+    return total
+
+
+def next_id(db: sqlite3.Connection, table: str) -> int:
+    return db.execute(f'SELECT COALESCE(MAX("id"), 0) + 1 FROM "{table}"').fetchone()[0]
+
+
+def pen_rows(rnd: random.Random, first: int, count: int, prices: dict[int, float],
+             stocks: dict[int, int]) -> Iterator[tuple]:
+    for pen_id in range(first, first + count):
+        # most pens are cheap, a few are luxury items
+        price = round(min(rnd.lognormvariate(2.5, 0.8), 2000), 2)
+        prices[pen_id] = price
+        stocks[pen_id] = rnd.randint(0, 5_000)
+        yield (pen_id, rnd.choice(BRANDS), price, stocks[pen_id],
+               rnd.choice(COLORS), rnd.randint(9, 20), int(rnd.random() < 0.02))
+
+
+def user_rows(rnd: random.Random, first: int, count: int) -> Iterator[tuple]:
+    for user_id in range(first, first + count):
+        role = 'admin' if rnd.random() < 0.001 else 'customer'
+        yield (user_id, role, f'user{user_id:08d}', f'password{user_id}', round(rnd.expovariate(1 / 500), 2))
+
+
+def session_rows(rnd: random.Random, users: list[int], count: int, now: datetime) -> Iterator[tuple]:
+    for _ in range(count):
+        # a fifth of the sessions are already expired and waiting for clean_sessions
+        expiry = now + timedelta(hours=rnd.uniform(-24, 24 * 4))
+        yield (str(uuid.UUID(int=rnd.getrandbits(128), version=4)), stamp(expiry), rnd.choice(users))
+
+
+class Ledger:
+    # mirrors record_purchase and record_refund; totals stay in memory until the end
+    def __init__(self):
+        self.entries: list[tuple] = []
+        self.spend: dict[int, list] = {}
+        self.sales: dict[int, int] = {}
+        self.revenue: dict[str, list] = {}
+
+    def _totals(self, user_id: int, order: dict[int, int], day: str, amount: float, sign: int) -> None:
+        spend = self.spend.setdefault(user_id, [0.0, 0])
+        spend[0] += sign * amount
+        spend[1] += sign
+        for pen_id, number in order.items():
+            self.sales[pen_id] = self.sales.get(pen_id, 0) + sign * number
+        revenue = self.revenue.setdefault(day, [0.0, 0])
+        revenue[0] += sign * amount
+        revenue[1] += sign
+
+    def book(self, transaction_id: int, user_id: int, price: float, moment: datetime,
+             status: str, order: dict[int, int]) -> None:
+        if status not in ('completed', 'refunded'):
+            return
+        # completing charges the price once per order line, refunding gives the price back once
+        charged = round(price * len(order), 2)
+        day = moment.date().isoformat()
+        self.entries.append(('purchase', user_id, None, transaction_id, -charged, 0, stamp(moment)))
+        self.entries.extend(('purchase', None, pen_id, transaction_id, 0, -number, stamp(moment))
+                            for pen_id, number in order.items())
+        self._totals(user_id, order, day, charged, 1)
+        if status == 'refunded':
+            refunded = stamp(moment + timedelta(minutes=1))
+            self.entries.append(('refund', user_id, None, transaction_id, price, 0, refunded))
+            self.entries.extend(('refund', None, pen_id, transaction_id, 0, number, refunded)
+                                for pen_id, number in order.items())
+            self._totals(user_id, order, day, charged, -1)
+
+
+def transaction_rows(rnd: random.Random, first: int, count: int, days: int, now: datetime,
+                     users: list[int], user_weights: list[float],
+                     pens: list[int], pen_weights: list[float], prices: dict[int, float],
+                     lines: list[tuple], ledger: Ledger) -> Iterator[tuple]:
+    for transaction_id in range(first, first + count):
+        status = rnd.choice(STATUSES)
+        if status == 'requested':
+            timestamp = now - timedelta(seconds=rnd.uniform(0, TRANSACTION_REQUEST_THRESHOLD * 60))
+        else:
+            timestamp = now - timedelta(seconds=rnd.uniform(0, days * 24 * 60 * 60))
+        size = min(1 + int(rnd.expovariate(1.2)), 10)
+        order = {}
+        for pen_id in rnd.choices(pens, cum_weights=pen_weights, k=size):
+            order[pen_id] = order.get(pen_id, 0) + min(1 + int(rnd.expovariate(0.7)), 50)
+        lines.extend((transaction_id, pen_id, number) for pen_id, number in order.items())
+        price = round(sum(prices[pen_id] * number for pen_id, number in order.items()), 2)
+        user_id = rnd.choices(users, cum_weights=user_weights)[0]
+        ledger.book(transaction_id, user_id, price, timestamp, status, order)
+        yield (transaction_id, user_id, price, stamp(timestamp),
+               order_json(order), status)
+
+
+def add_totals(db: sqlite3.Connection, table: str, key: str, columns: tuple[str, ...], rows: list[tuple]) -> None:
+    # counters may already exist when generating into a populated database
+    names = ', '.join(f'"{column}"' for column in (key, *columns))
+    updates = ', '.join(f'"{column}" = "{column}" + excluded."{column}"' for column in columns)
+    db.executemany(f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * (len(columns) + 1))}) '
+                   f'ON CONFLICT("{key}") DO UPDATE SET {updates}', rows)
+    db.commit()
+    print(f"{table:<16} {len(rows):>12,} rows")
+
+
+def drop_indexes(db: sqlite3.Connection) -> list[str]:
+    # bulk loads are much faster into bare tables; unique constraints stay, they are not in this list
+    indexes = db.execute("SELECT name, sql FROM sqlite_master "
+                         "WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    for name, _ in indexes:
+        db.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def create_indexes(db: sqlite3.Connection, indexes: list[str]) -> None:
+    started = time.perf_counter()
+    for sql in indexes:
+        db.execute(sql)
+    db.commit()
+    print(f"{len(indexes)} indexes rebuilt in {time.perf_counter() - started:.1f}s")
+
+
+def order_json(order: dict[int, int]) -> str:
+    # same text json.dumps gives, without its per call overhead
+    return '[' + ', '.join(f'{{"penId": {pen_id}, "number": {number}}}' for pen_id, number in order.items()) + ']'
+
+
+def generate(db: sqlite3.Connection, seed: int, users: int, pens: int, transactions: int,
+             sessions: int, days: int, skew: float, user_skew: float) -> None:
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    prices: dict[int, float] = {}
+    stocks: dict[int, int] = {}
+    first_pen = next_id(db, 'pen')
+    insert(db, 'pen', ('id', 'brand', 'price', 'stock', 'color', 'length', 'is_deleted'),
+           pen_rows(rnd, first_pen, pens, prices, stocks))
+    first_user = next_id(db, 'user')
+    insert(db, 'user', ('id', 'role', 'name', 'password', 'credit'), user_rows(rnd, first_user, users))
+
+    user_ids = list(range(first_user, first_user + users))
+    pen_ids = list(range(first_pen, first_pen + pens))
+    # hot SKUs and long-tail users: which ids are hot is shuffled, not simply the lowest ones
+    rnd.shuffle(user_ids)
+    rnd.shuffle(pen_ids)
+    insert(db, 'session', ('token', 'expiry', 'user_id'), session_rows(rnd, user_ids, sessions, now))
+
+    first_transaction = next_id(db, 'transaction')
+    user_weights = zipf_weights(users, user_skew)
+    pen_weights = zipf_weights(pens, skew)
+    ledger = Ledger()
+    remaining = transactions
+    while remaining:
+        # lines are collected per batch so memory stays flat at any scale
+        batch = min(remaining, CHUNK * 10)
+        lines: list[tuple] = []
+        insert(db, 'transaction', ('id', 'user_id', 'price', 'timestamp', 'order', 'status'),
+               transaction_rows(rnd, first_transaction, batch, days, now,
+                                user_ids, user_weights, pen_ids, pen_weights, prices, lines, ledger))
+        insert(db, 'transactionline', ('transaction_id', 'pen_id', 'number'), iter(lines))
+        insert(db, 'ledgerentry', ('kind', 'user_id', 'pen_id', 'transaction_id', 'credit', 'stock', 'timestamp'),
+               iter(ledger.entries))
+        ledger.entries.clear()
+        first_transaction += batch
+        remaining -= batch
+    # opening stock, so that each pen's ledger deltas add up to its stock
+    opened = stamp(now - timedelta(days=days + 1))
+    insert(db, 'ledgerentry', ('kind', 'pen_id', 'stock', 'timestamp'),
+           (('initial', pen_id, stock + ledger.sales.get(pen_id, 0), opened) for pen_id, stock in stocks.items()))
+    add_totals(db, 'userspend', 'user_id', ('spent', 'transactions'),
+               [(user_id, round(spent, 2), count) for user_id, (spent, count) in ledger.spend.items()])
+    add_totals(db, 'pensales', 'pen_id', ('units',), list(ledger.sales.items()))
+    add_totals(db, 'dailyrevenue', 'day', ('revenue', 'transactions'),
+               [(day, round(revenue, 2), count) for day, (revenue, count) in ledger.revenue.items()])
+
+
+async def create_schema(path: str) -> None:
+    await Tortoise.init(db_url=f'sqlite://{path}', modules={'models': ['shopen.models.models']})
+    await Tortoise.generate_schemas(safe=True)
+    await migrate_version_columns()
+    await Tortoise.close_connections()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Populate a ShoPen database with synthetic data")
+    parser.add_argument('--db', default='db.sqlite3', help='sqlite file, created if missing')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--pens', type=int, default=10_000)
+    parser.add_argument('--transactions', type=int, default=500_000)
+    parser.add_argument('--sessions', type=int, default=50_000)
+    parser.add_argument('--days', type=int, default=365, help='history spread of the transactions')
+    parser.add_argument('--skew', type=float, default=1.1, help='zipf exponent of pen popularity')
+    parser.add_argument('--user-skew', type=float, default=0.8, help='zipf exponent of user activity')
+    args = parser.parse_args()
+    if args.users < 1 or args.pens < 1:
+        parser.error('at least one user and one pen are needed')
+
+    asyncio.run(create_schema(args.db))
+    db = sqlite3.connect(args.db)
+    db.executescript('PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY;')
+    started = time.perf_counter()
+    indexes = drop_indexes(db)
+    generate(db, args.seed, args.users, args.pens, args.transactions, args.sessions,
+             args.days, args.skew, args.user_skew)
+    create_indexes(db, indexes)
+    db.execute('ANALYZE')
+    db.close()
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Compare listing through model instances against values() projections.
+# Run from the repository root: python -m benchmarks.projections [rows]
+import asyncio
+import sys
+import time
+import tracemalloc
+from tortoise import Tortoise
+from shopen.models.models import Pen
+from shopen.middleware.pens import list_pens, list_pen_rows
+
+
+async def via_models() -> list[dict]:
+    return [{"id": pen.id,
+             "brand": pen.brand,
+             "price": pen.price,
+             "stock": pen.stock,
+             "color": pen.color,
+             "length": pen.length} for pen in await list_pens()]
+
+
+async def via_projection() -> list[dict]:
+    return await list_pen_rows()
+
+
+async def measure(name: str, read, rows: int, repeat: int) -> None:
+    await read()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await read()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    await read()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<12} {rows * repeat / elapsed:>12,.0f} rows/s {peak / 1024 / 1024:>8.1f} MiB peak")
+
+
+async def main(rows: int, repeat: int = 5) -> None:
+    await Tortoise.init(db_url='sqlite://:memory:', modules={'models': ['shopen.models.models']})
+    await Tortoise.generate_schemas()
+    await Pen.bulk_create([Pen(brand=f'brand{i % 50}', price=i % 100, stock=i % 500,
+                               color='blue', length=15) for i in range(rows)], batch_size=1000)
+    await measure('models', via_models, rows, repeat)
+    await measure('projection', via_projection, rows, repeat)
+    await Tortoise.close_connections()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000))
@@ -1,31 +1,19 @@
 from typing import Optional, List
-import random
-import asyncio
-from fastapi import APIRouter, Query, Depends
+from fastapi import APIRouter, Query
 from fastapi.responses import JSONResponse
-from shopen.middleware.auth import get_api_key, get_user_by_token
+from shopen.middleware.holders import list_holders, holder_payload
+from shopen.settings import HOLDERS_PAGE_LIMIT
 
 router = APIRouter()
 
 
 @router.get("", summary="List pen holders",
             description="List holders for pens in the system. No authentication required")
-async def list_holders_api():
-    data = {'list': [
-        {
-            'penId': 1,
-            'name': 'holderMax',
-            'capacity': 10
-        },
-        {
-            'penId': 1,
-            'name': 'Thule',
-            'capacity': 25
-        },
-        {
-            'penId': 3,
-            'name': 'HELLo',
-            'capacity': 666
-        },
-    ]}
-    return JSONResponse(status_code=200, content=data)
+async def list_holders_api(
+        pen_id: Optional[List[int]] = Query(None, alias='penId', description='ids of compatible pens'),
+        min_capacity: Optional[int] = Query(None, alias='minCapacity', description='minimum holder capacity'),
+        max_capacity: Optional[int] = Query(None, alias='maxCapacity', description='maximum holder capacity'),
+        limit: int = Query(HOLDERS_PAGE_LIMIT, alias='limit', description='page size'),
+        offset: int = Query(0, alias='offset', description='number of holders to skip')):
+    holders = await list_holders(pen_id, min_capacity, max_capacity, limit, offset)
+    return JSONResponse(status_code=200, content={'list': [holder_payload(h) for h in holders]})
@@ -0,0 +1,46 @@
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Query, Depends
+from fastapi.responses import JSONResponse
+from shopen.middleware.auth import get_api_key, get_admin_by_token
+from shopen.middleware.ledger import get_user_spend, get_pen_sales, list_daily_revenue
+
+router = APIRouter()
+
+
+@router.get("/users/{user_id}/spend", summary="User spend",
+            description="Total spend and number of purchases of a user. Admins only")
+async def user_spend_api(user_id: int, api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can view reports")
+    spend = await get_user_spend(user_id)
+    return JSONResponse(status_code=200, content={
+        "userId": spend.user_id,
+        "spent": spend.spent,
+        "transactions": spend.transactions
+    })
+
+
+@router.get("/pens/{pen_id}/sales", summary="Pen sales",
+            description="Number of units sold of a pen. Admins only")
+async def pen_sales_api(pen_id: int, api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can view reports")
+    sales = await get_pen_sales(pen_id)
+    return JSONResponse(status_code=200, content={
+        "penId": sales.pen_id,
+        "units": sales.units
+    })
+
+
+@router.get("/revenue", summary="Daily revenue",
+            description="Revenue per day in the given range of dates. Admins only")
+async def daily_revenue_api(
+        start: Optional[date] = Query(None, alias='from', description='first day, YYYY-MM-DD'),
+        end: Optional[date] = Query(None, alias='to', description='last day, YYYY-MM-DD'),
+        api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can view reports")
+    days = await list_daily_revenue(start, end)
+    return JSONResponse(status_code=200, content={
+        "days": [{"day": d.day.isoformat(),
+                  "revenue": d.revenue,
+                  "transactions": d.transactions} for d in days]
+    })
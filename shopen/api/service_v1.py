@@ -1,7 +1,15 @@
 import asyncio
-from fastapi import APIRouter, Depends
-from fastapi.responses import PlainTextResponse
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse, JSONResponse
 from shopen.models.schemas import UserCredentials
+from shopen.middleware import metrics
+from shopen.middleware.auth import get_api_key, get_admin_by_token
+from shopen.middleware.profiling import loop_monitor, sample_profile
+from shopen.middleware.slowlog import slow_queries
+from shopen.middleware.audit import list_audit_rows
+from shopen.middleware.plans import plan_guard
+from shopen.settings import PROFILE_MAX_SECONDS, SLOW_QUERY_TOP, AUDIT_PAGE_LIMIT
 
 router = APIRouter()
 
@@ -9,3 +17,75 @@ router = APIRouter()
 async def service_readme():
     with open("devchallenge.md", 'r') as file:
         return PlainTextResponse(status_code=200, content=file.read())
+
+
+@router.get("/metrics", summary="Get metrics", description="Get in-process metrics of background jobs and caches")
+async def service_metrics():
+    return JSONResponse(status_code=200, content=metrics.snapshot())
+
+
+@router.get("/loop", summary="Event loop health",
+            description="Scheduling lag of the event loop and stacks of recent blocking calls. Admins only")
+async def service_loop(api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can inspect the event loop")
+    return JSONResponse(status_code=200, content={
+        "lag": metrics.snapshot()["summaries"].get("event_loop.lag_seconds", {}),
+        "blocked": list(loop_monitor.blocked)
+    })
+
+
+@router.get("/profile", summary="Sampling profile",
+            description="Sample the event loop thread for a number of seconds and return collapsed stacks "
+                        "ready for flamegraph tools. Admins only")
+async def service_profile(seconds: float = Query(5, alias='seconds', description='how long to sample'),
+                          api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can profile the service")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Profile duration must be between 0 and {PROFILE_MAX_SECONDS} seconds")
+    return PlainTextResponse(status_code=200, content=await sample_profile(seconds))
+
+
+@router.get("/slow-queries", summary="Slow queries",
+            description="Statements slower than the configured threshold, grouped by statement and ordered "
+                        "by total time, with their query plan. Admins only")
+async def service_slow_queries(limit: int = Query(SLOW_QUERY_TOP, alias='limit', description='number of statements'),
+                               api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can inspect queries")
+    return JSONResponse(status_code=200, content={"threshold": slow_queries.threshold,
+                                                  "statements": slow_queries.top(limit)})
+
+
+@router.get("/plans", summary="Query plan guard",
+            description="Query budgets of the hot endpoints, their latest query counts and "
+                        "any budget overrun or unexpected table scan seen so far. Admins only")
+async def service_plans(api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can inspect queries")
+    return JSONResponse(status_code=200, content={
+        "endpoints": {name: {"queries": hot.queries, "perLine": hot.per_line, "scans": list(hot.scans),
+                             "last": plan_guard.last.get(name)}
+                      for name, hot in plan_guard.endpoints.items()},
+        "violations": list(plan_guard.violations)
+    })
+
+
+@router.get("/audit", summary="Audit trail",
+            description="Admin and money-moving actions, newest first. "
+                        "Pass the returned 'next' as 'before' to get older records. Admins only")
+async def service_audit(action: Optional[str] = Query(None, alias='action', description='e.g. pen.restocked'),
+                        actor_id: Optional[int] = Query(None, alias='actorId', description='id of the acting user'),
+                        before: Optional[int] = Query(None, alias='before', description='last id of the previous page'),
+                        limit: int = Query(AUDIT_PAGE_LIMIT, alias='limit', description='page size'),
+                        api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can read the audit trail")
+    records = await list_audit_rows(action, actor_id, before, limit)
+    return JSONResponse(status_code=200, content={
+        "records": [{"id": record['id'],
+                     "action": record['action'],
+                     "actorId": record['actor_id'],
+                     "subject": record['subject'],
+                     "details": record['details'],
+                     "timestamp": record['timestamp'].isoformat()} for record in records],
+        "next": records[-1]['id'] if len(records) == limit else None
+    })
@@ -2,13 +2,21 @@ from typing import Optional, List
 import random
 import asyncio
 from fastapi import APIRouter, Query, Depends
-from fastapi.responses import JSONResponse
-from shopen.middleware.pens import (list_pens, get_pen, add_pen,
+from fastapi.responses import JSONResponse, StreamingResponse
+from shopen.middleware.pens import (list_pen_rows, get_pen, add_pen,
                                     restock_pen, delete_pen)
 from shopen.middleware.auth import get_api_key, get_user_by_token
+from shopen.middleware.broadcast import stock_events
+from shopen.middleware.singleflight import SingleFlight
+from shopen.middleware.holders import holders_by_pen
 from shopen.models.schemas import (PenRequest, NewPen)
 
 router = APIRouter()
+pen_reads = SingleFlight("pens.reads")
+
+
+def _normalise(values: Optional[List[str]]) -> Optional[tuple]:
+    return tuple(sorted(set(values))) if values else None
 
 
 @router.get("", summary="List pens", description="List pens in the system. No authentication required")
@@ -19,27 +27,37 @@ async def list_pens_api(
         min_stock: Optional[int] = Query(None, alias='minStock', description='minimum pens in stock'),
         color: Optional[List[str]] = Query(None, alias='color', description='name of colors, coma separated'),
         min_length: Optional[int] = Query(None, alias='minLength', description='minimum pen length'),
-        max_length: Optional[int] = Query(None, alias='maxLength', description='maximum pen length')):
+        max_length: Optional[int] = Query(None, alias='maxLength', description='maximum pen length'),
+        include: Optional[str] = Query(None, alias='include', description='holders: embed compatible holders')):
     # Bug #8
     color, min_length, max_length = None, None, None
-    pens = await list_pens(brand, min_price, max_price, min_stock, color, min_length, max_length)
-    return JSONResponse(status_code=200, content={
-        "pens": [{"id": pen.id,
-                  "brand": pen.brand,
-                  "price": pen.price,
-                  "stock": pen.stock,
-                  "color": pen.color,
-                  "length": pen.length} for pen in pens]
-    })
+    key = ('list', _normalise(brand), min_price, max_price, min_stock,
+           _normalise(color), min_length, max_length)
+    pens = await pen_reads.do(key, lambda: list_pen_rows(brand, min_price, max_price, min_stock,
+                                                         color, min_length, max_length))
+    if include == 'holders':
+        holders = await holders_by_pen([pen['id'] for pen in pens])
+        pens = [{**pen, "holders": holders[pen['id']]} for pen in pens]
+    return JSONResponse(status_code=200, content={"pens": pens})
+
+
+@router.get("/stream", summary="Stream stock updates",
+            description="Server-Sent Events: a snapshot of pens followed by coalesced stock, price "
+                        "and delete updates. No authentication required")
+async def stream_pens_api():
+    return StreamingResponse(stock_events(list_pen_rows), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.get("/{pen_id}", summary="Get pen", description="Get pen by id. No authentication required")
-async def get_pen_api(pen_id: int):
-    pen = await get_pen(pen_id)
+async def get_pen_api(pen_id: int,
+                      include: Optional[str] = Query(None, alias='include',
+                                                     description='holders: embed compatible holders')):
+    pen = await pen_reads.do(('get', pen_id), lambda: get_pen(pen_id))
 
     # BUG 5
     await asyncio.sleep(3.33)
-    return JSONResponse(status_code=200, content={
+    content = {
         "id": pen.id,
         "brand": pen.brand,
         # BUG 3
@@ -47,7 +65,10 @@ async def get_pen_api(pen_id: int):
         "stock": pen.stock + 1.1,
         "color": pen.color,
         "length": pen.length
-    })
+    }
+    if include == 'holders':
+        content["holders"] = (await holders_by_pen([pen.id]))[pen.id]
+    return JSONResponse(status_code=200, content=content)
 
 
 @router.post("/add", summary="Add pen", description="Add a new pen to the system. Admins only")
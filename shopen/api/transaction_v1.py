@@ -1,10 +1,13 @@
 from typing import Optional
-from fastapi import APIRouter, Query, Depends
-from fastapi.responses import JSONResponse
+from datetime import datetime
+from fastapi import APIRouter, Query, Depends, Header, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from shopen.middleware.pens import (get_transaction,
-                                    list_transactions, request_pens, complete_transaction,
+                                    list_transaction_rows, request_pens, quote_pens, complete_transaction,
                                     cancel_transaction, refund_transaction)
-from shopen.middleware.auth import get_api_key, get_user_by_token
+from shopen.middleware.auth import get_api_key, get_user_by_token, get_admin_by_token, get_session_user
+from shopen.middleware.export import EXPORT_FORMATS, export_transactions, gzip_stream
+from shopen.middleware.idempotency import idempotent
 from shopen.models.schemas import TransactionRequest
 
 router = APIRouter()
@@ -19,18 +22,41 @@ async def list_transactions_api(
     if show_own is None:
         show_own = True
     user = await get_user_by_token(api_key)
-    transactions = await list_transactions(user, show_own, status)
+    transactions = await list_transaction_rows(user, show_own, status)
     return JSONResponse(status_code=200, content={
-        "transactions": [{"id": t.id,
-                          "userId": (await t.user).id,
-                          "status": t.status,
-                          "price": t.price,
-                          "timestamp": t.timestamp.isoformat(),
-                          "order": t.order}
+        "transactions": [{"id": t['id'],
+                          "userId": t['user_id'],
+                          "status": t['status'],
+                          "price": t['price'],
+                          "timestamp": t['timestamp'].isoformat(),
+                          "order": t['order']}
                          for t in transactions]
     })
 
 
+@router.get("/export", summary="Export transactions",
+            description="Stream all transactions as CSV or NDJSON, optionally gzipped. Admins only")
+async def export_transactions_api(
+        fmt: str = Query('csv', alias='format', description='csv or ndjson'),
+        start: Optional[datetime] = Query(None, alias='from', description='created at or after, ISO 8601'),
+        end: Optional[datetime] = Query(None, alias='to', description='created before, ISO 8601'),
+        status: Optional[str] = Query(None, alias='status',
+                                      description='filter by status: requested, completed, cancelled, refunded'),
+        gzip: bool = Query(False, alias='gzip', description='compress the stream on the fly'),
+        api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can export transactions")
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+    body = export_transactions(fmt, start, end, status)
+    headers = {"Content-Disposition": f"attachment; filename=transactions.{fmt}"}
+    if gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[fmt], headers=headers)
+
+
 @router.get("/{transaction_id}", summary="Get transaction", description="Get transaction by id")
 async def get_transaction_api(transaction_id: int, api_key: str = Depends(get_api_key)):
     user = await get_user_by_token(api_key)
@@ -38,7 +64,7 @@ async def get_transaction_api(transaction_id: int, api_key: str = Depends(get_ap
     # Bug #7
     return JSONResponse(status_code=418, content={
         "id": transaction.id,
-        "userId": (await transaction.user).id,
+        "userId": transaction.user_id,
         "status": transaction.status,
         "price": transaction.price,
         "timestamp": transaction.timestamp.isoformat(),
@@ -46,25 +72,42 @@ async def get_transaction_api(transaction_id: int, api_key: str = Depends(get_ap
     })
 
 
+@router.post("/quote", summary="Quote pens",
+             description="Price an order with discounts and check stock without creating a transaction")
+async def quote_pens_api(invoice: TransactionRequest, api_key: str = Depends(get_api_key)):
+    user = await get_session_user(api_key)
+    return JSONResponse(status_code=200, content=await quote_pens(user, invoice))
+
+
 @router.post("/request", summary="Request pens", description="Create a new transaction request in state requested")
-async def request_pens_api(invoice: TransactionRequest, api_key: str = Depends(get_api_key)):
-    user = await get_user_by_token(api_key)
-    transaction = await request_pens(user, invoice)
-    return JSONResponse(status_code=201, content={
-        "id": transaction.id,
-        "userId": (await transaction.user).id,
-        "status": transaction.status,
-        "price": transaction.price,
-        "timestamp": transaction.timestamp.isoformat(),
-        "order": transaction.order
-    })
+async def request_pens_api(invoice: TransactionRequest, request: Request,
+                           api_key: str = Depends(get_api_key),
+                           idempotency_key: Optional[str] = Header(None, alias='Idempotency-Key')):
+    async def handler():
+        user = await get_user_by_token(api_key)
+        transaction = await request_pens(user, invoice)
+        return JSONResponse(status_code=201, content={
+            "id": transaction.id,
+            "userId": transaction.user_id,
+            "status": transaction.status,
+            "price": transaction.price,
+            "timestamp": transaction.timestamp.isoformat(),
+            "order": transaction.order
+        })
+
+    return await idempotent(idempotency_key, f"{api_key}:{request.url.path}", handler, await request.body())
 
 
 @router.post("/{transaction_id}/complete", summary="Complete transaction", description="Pens amount are reduced as well as user credit")
-async def complete_transaction_api(transaction_id: int, api_key: str = Depends(get_api_key)):
-    user = await get_user_by_token(api_key)
-    await complete_transaction(user, transaction_id)
-    return JSONResponse(status_code=200, content={"message": "Transaction completed"})
+async def complete_transaction_api(transaction_id: int, request: Request,
+                                   api_key: str = Depends(get_api_key),
+                                   idempotency_key: Optional[str] = Header(None, alias='Idempotency-Key')):
+    async def handler():
+        user = await get_user_by_token(api_key)
+        await complete_transaction(user, transaction_id)
+        return JSONResponse(status_code=200, content={"message": "Transaction completed"})
+
+    return await idempotent(idempotency_key, f"{api_key}:{request.url.path}", handler, await request.body())
 
 
 @router.post("/{transaction_id}/cancel", summary="Cancel transaction", description="Cancel a requested transaction")
@@ -76,7 +119,12 @@ async def cancel_transaction_api(transaction_id: int, api_key: str = Depends(get
 
 
 @router.post("/{transaction_id}/refund", summary="Refund transaction", description="Refund a completed transaction")
-async def refund_transaction_api(transaction_id: int, api_key: str = Depends(get_api_key)):
-    user = await get_user_by_token(api_key)
-    await refund_transaction(user, transaction_id)
-    return JSONResponse(status_code=200, content={"message": "Transaction refunded"})
+async def refund_transaction_api(transaction_id: int, request: Request,
+                                 api_key: str = Depends(get_api_key),
+                                 idempotency_key: Optional[str] = Header(None, alias='Idempotency-Key')):
+    async def handler():
+        user = await get_user_by_token(api_key)
+        await refund_transaction(user, transaction_id)
+        return JSONResponse(status_code=200, content={"message": "Transaction refunded"})
+
+    return await idempotent(idempotency_key, f"{api_key}:{request.url.path}", handler, await request.body())
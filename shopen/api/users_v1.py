@@ -1,21 +1,56 @@
 import asyncio
-from fastapi import APIRouter, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
 from fastapi.responses import JSONResponse
 from shopen.middleware.auth import (authenticate, create_user,
-                                    promote_user, get_api_key, get_user_by_token,
-                                    get_user, delete_session, list_users, edit_user)
-from shopen.models.schemas import UserCredentials
+                                    promote_user, get_api_key, get_user_by_token, get_admin_by_token,
+                                    get_user, delete_session, list_user_rows, edit_user,
+                                    search_user_rows, bulk_set_credit)
+from shopen.middleware.ledger import record_credit
+from shopen.middleware.routing import in_primary_transaction
+from shopen.middleware.versioning import swap, retry_stale
+from shopen.middleware.audit import audit_log
+from shopen.models.schemas import UserCredentials, BulkCredit
+from shopen.settings import USERS_PAGE_LIMIT
 
 router = APIRouter()
 
 @router.get("/list", summary="List all users", description="List all users in the system")
 async def user_list(api_key: str = Depends(get_api_key)):
-    users = await list_users(api_key)
+    users = await list_user_rows(api_key)
     return JSONResponse(status_code=200, content={
-        "users": [{"id": user.id, "username": user.name, "role": user.role, "credit": user.credit} for user in users]
+        "users": [{"id": user['id'], "username": user['name'], "role": user['role'], "credit": user['credit']}
+                  for user in users]
     })
 
 
+@router.get("/search", summary="Search users",
+            description="Find users by name prefix and role, in name order. "
+                        "Pass the returned 'next' as 'after' to get the following page. Admins only")
+async def user_search(prefix: Optional[str] = Query(None, alias='prefix', description='start of the username'),
+                      role: Optional[str] = Query(None, alias='role', description='customer or admin'),
+                      limit: int = Query(USERS_PAGE_LIMIT, alias='limit', description='page size'),
+                      after: Optional[str] = Query(None, alias='after', description='last username of the previous page'),
+                      api_key: str = Depends(get_api_key)):
+    await get_admin_by_token(api_key, "Only admins can search users")
+    users = await search_user_rows(prefix, role, limit, after)
+    return JSONResponse(status_code=200, content={
+        "users": [{"id": user['id'], "username": user['name'], "role": user['role'], "credit": user['credit']}
+                  for user in users],
+        "next": users[-1]['name'] if len(users) == limit else None
+    })
+
+
+@router.post("/credit", summary="Bulk credit",
+             description="Set or increment credit of many users at once. Admins only")
+async def user_bulk_credit(request: BulkCredit, api_key: str = Depends(get_api_key)):
+    admin = await get_admin_by_token(api_key, "Only admins can set user credit")
+    summary = await bulk_set_credit(request.operation, request.amount, request.users)
+    audit_log.record('user.credit.bulk', admin, None, operation=request.operation, amount=request.amount,
+                     updated=summary['updated'], users=len(request.users))
+    return JSONResponse(status_code=200, content={"requested": len(request.users), **summary})
+
+
 @router.post("/login", summary="Login",
              description="Login to the system. Returns a token to be used in Authentication header")
 async def user_login(credentials: UserCredentials):
@@ -76,17 +111,25 @@ async def user_promote(user_id: int, api_key: str = Depends(get_api_key)):
 @router.patch("/user/{user_id}/credit", summary="Set user credit",
               description="Set user credit by admin to make purchases")
 async def set_user_credit(user_id: int, credit: float, api_key: str = Depends(get_api_key)):
-    user = await get_user_by_token(api_key)
-    if user.role != 'admin':
+    admin = await get_user_by_token(api_key)
+    if admin.role != 'admin':
         return JSONResponse(status_code=403, content={"error": "Only admins can set user credit"})
 
     user = await get_user(id=user_id)
-    # BUG #4
-    if  0 <= credit <= 10:
-        user.credit = 666
-    else:
-        user.credit = credit
-    await user.save()
+
+    async def set_credit() -> None:
+        previous = user.credit
+        # BUG #4
+        if  0 <= credit <= 10:
+            new_credit = 666
+        else:
+            new_credit = credit
+        async with in_primary_transaction():
+            await swap(user, credit=new_credit)
+            await record_credit(user.id, user.credit - previous)
+
+    await retry_stale(set_credit, user)
+    audit_log.record('user.credit', admin, f"user:{user.id}", credit=user.credit)
     return JSONResponse(status_code=200, content={"message": "User credit set"})
 
 
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse, HTMLResponse
 from tortoise import Tortoise
-from shopen.settings import DB_CONFIG, SUPER_ADMIN_TOKEN, VERSION
+from shopen.settings import DB_CONFIG, SUPER_ADMIN_TOKEN, VERSION, DB_MEMORY
 from tortoise.contrib.fastapi import register_tortoise
 from contextlib import asynccontextmanager
 from pydantic import ValidationError
@@ -10,17 +10,46 @@ from shopen.api.shop_v1 import router as shop_router
 from shopen.api.transaction_v1 import router as transaction_router
 from shopen.api.service_v1 import router as service_router
 from shopen.api.holder_v1 import router as holder_router
+from shopen.api.report_v1 import router as report_router
 from shopen.models.setup import (is_db_empty, setup_reset,
-                                 set_default_stock, set_default_users)
+                                 set_default_stock, set_default_users,
+                                 set_default_holders, migrate_holders, migrate_transaction_lines,
+                                 migrate_version_columns)
+from shopen.middleware.jobs import start_background_jobs, stop_jobs
+from shopen.middleware.reservations import reservations
+from shopen.middleware.pens import transaction_writes
+from shopen.middleware.admission import AdmissionControl
+from shopen.middleware.routing import ReadRouting
+from shopen.middleware.limits import BodySizeLimit
+from shopen.middleware.profiling import loop_monitor
+from shopen.middleware.slowlog import QueryContext, install_connections
+from shopen.middleware.audit import audit_log
+from shopen.middleware.snapshots import save_snapshot, restore_snapshot
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if DB_MEMORY:
+        await restore_snapshot()
+    install_connections()
+    await migrate_version_columns()
     if await is_db_empty():
         await set_default_users()
-        await set_default_stock()
+        await set_default_holders(await set_default_stock())
+    await migrate_holders()
+    await migrate_transaction_lines()
+    start_background_jobs()
+    loop_monitor.start()
+    audit_log.start()
     yield
     # do something after the application stops
+    await loop_monitor.stop()
+    await stop_jobs()
+    await transaction_writes.drain()
+    # buffered audit records are written before the connections go away
+    await audit_log.stop()
+    if DB_MEMORY:
+        await save_snapshot()
     await Tortoise.close_connections()
 
 
@@ -30,12 +59,17 @@ app = FastAPI(title="Shopen API",
               openapi_url="/api/v1/openapi.json",
               docs_url="/api/v1/docs",
               lifespan=lifespan)
+app.add_middleware(QueryContext)
+app.add_middleware(ReadRouting)
+app.add_middleware(AdmissionControl)
+app.add_middleware(BodySizeLimit)
 # app.mount('/assets', StaticFiles(directory=STATIC_ROOT), name='assets')
 app.include_router(user_router, prefix="/api/v1/users", tags=["users"])
 app.include_router(shop_router, prefix="/api/v1/pens", tags=["shop"])
 app.include_router(transaction_router, prefix="/api/v1/transactions", tags=["transactions"])
 app.include_router(service_router, prefix="/api/v1/service", tags=["service"])
 app.include_router(holder_router, prefix='/api/v1/holders', tags=['holders'])
+app.include_router(report_router, prefix='/api/v1/reports', tags=['reports'])
 
 register_tortoise(app=app,
                   config=DB_CONFIG,
@@ -71,6 +105,8 @@ async def factory_reset(key: str):
             status_code=403,
             detail="Only super admin can reset the database")
     await setup_reset()
+    audit_log.record('factory_reset')
+    reservations.clear()
     await set_default_users()
-    await set_default_stock()
+    await set_default_holders(await set_default_stock())
     return {"message": "Factory reset done"}
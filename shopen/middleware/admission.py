@@ -0,0 +1,102 @@
+import asyncio
+import json
+from typing import Optional
+from shopen.middleware import metrics
+from shopen.settings import (ADMISSION_CONTROL, ADMISSION_LIMITS,
+                             ADMISSION_QUEUES, ADMISSION_TIMEOUTS)
+
+# long-lived responses must not hold a slot for their whole lifetime
+UNLIMITED_PATHS = {'/api/v1/pens/stream'}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    if path in UNLIMITED_PATHS:
+        return None
+    if path.startswith('/api/v1/users/') and path.rsplit('/', 1)[-1] in ('login', 'register', 'logout'):
+        return 'auth'
+    if (path.startswith('/api/v1/reports') or path.startswith('/factoryReset')
+            or path.startswith('/api/v1/service/') and path != '/api/v1/service/readme'
+            or path in ('/api/v1/transactions/export', '/api/v1/users/list',
+                        '/api/v1/users/search', '/api/v1/users/credit')):
+        return 'admin'
+    if path.startswith('/api/v1/users/user/') and path.rsplit('/', 1)[-1] in ('credit', 'promote'):
+        return 'admin'
+    if path == '/api/v1/transactions/quote':
+        return 'catalogue'
+    if path.startswith('/api/v1/transactions') and method == 'POST':
+        return 'checkout'
+    if path.startswith('/api/v1/pens') or path.startswith('/api/v1/holders'):
+        return 'catalogue' if method == 'GET' else 'admin'
+    return 'other'
+
+
+class Limiter:
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"admission.{self.name}.active", self.active)
+        metrics.set_gauge(f"admission.{self.name}.queue_depth", self.waiting)
+
+    async def acquire(self) -> bool:
+        if self._slots.locked():
+            if self.waiting >= self.queue_size:
+                metrics.inc(f"admission.{self.name}.rejected")
+                return False
+            self.waiting += 1
+            self._publish()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                metrics.inc(f"admission.{self.name}.timed_out")
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.active += 1
+        self._publish()
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        self._slots.release()
+        self._publish()
+
+
+class AdmissionControl:
+    def __init__(self, app, enabled: bool = ADMISSION_CONTROL):
+        self.app = app
+        self.enabled = enabled
+        self.limiters = {name: Limiter(name, limit,
+                                       ADMISSION_QUEUES.get(name, 0),
+                                       ADMISSION_TIMEOUTS.get(name, 1.0))
+                         for name, limit in ADMISSION_LIMITS.items()}
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope['method'], scope['path']) \
+            if self.enabled and scope['type'] == 'http' else None
+        limiter = self.limiters.get(route_class)
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        if not await limiter.acquire():
+            return await self._reject(send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    @staticmethod
+    async def _reject(send) -> None:
+        body = json.dumps({"message": "Server is busy, try again later"}).encode()
+        await send({'type': 'http.response.start',
+                    'status': 503,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode()),
+                                (b'retry-after', b'1')]})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import HTTPException
+from shopen.middleware import metrics
+from shopen.models.models import AuditRecord, User
+from shopen.settings import AUDIT_BATCH, AUDIT_FLUSH_INTERVAL, AUDIT_BUFFER, AUDIT_PAGE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    # Records are buffered in memory and written in batches, so handlers never wait
+    # for an extra commit. Flushes happen when a batch fills up, every `interval`
+    # seconds, before reads and on shutdown.
+    def __init__(self, batch: int = AUDIT_BATCH, interval: float = AUDIT_FLUSH_INTERVAL,
+                 limit: int = AUDIT_BUFFER):
+        self.batch = batch
+        self.interval = interval
+        self.limit = limit
+        self._pending: deque[AuditRecord] = deque()
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, action: str, actor: Optional[User] = None,
+               subject: Optional[str] = None, **details) -> None:
+        if len(self._pending) >= self.limit:
+            # the database is not keeping up, keep the newest records
+            self._pending.popleft()
+            metrics.inc("audit.dropped")
+        self._pending.append(AuditRecord(action=action,
+                                         actor_id=actor.id if actor is not None else None,
+                                         subject=subject,
+                                         details=details or None,
+                                         timestamp=datetime.now(timezone.utc)))
+        if len(self._pending) >= self.batch:
+            self._full.set()
+
+    async def flush(self) -> int:
+        written = 0
+        async with self._lock:
+            while self._pending:
+                records = [self._pending.popleft() for _ in range(min(self.batch, len(self._pending)))]
+                try:
+                    await AuditRecord.bulk_create(records)
+                except Exception:
+                    # back to the front, in order, for the next flush
+                    self._pending.extendleft(reversed(records))
+                    raise
+                written += len(records)
+        metrics.inc("audit.written", written)
+        metrics.set_gauge("audit.pending", len(self._pending))
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Audit flush failed, %d records pending", len(self._pending))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="audit_log")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+audit_log = AuditLog()
+
+
+async def list_audit_rows(action: Optional[str] = None, actor_id: Optional[int] = None,
+                          before: Optional[int] = None, limit: int = AUDIT_PAGE_LIMIT) -> list[dict]:
+    if not 0 < limit <= AUDIT_PAGE_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Limit must be between 1 and {AUDIT_PAGE_LIMIT}")
+    # what is still buffered is part of the trail too
+    await audit_log.flush()
+    filters = {}
+    if action is not None:
+        filters['action'] = action
+    if actor_id is not None:
+        filters['actor_id'] = actor_id
+    if before is not None:
+        filters['id__lt'] = before
+    return await AuditRecord.filter(**filters).order_by('-id').limit(limit) \
+        .values('id', 'action', 'actor_id', 'subject', 'details', 'timestamp')
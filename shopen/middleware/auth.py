@@ -3,7 +3,13 @@ from typing import Optional
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
+from tortoise.expressions import F
 from shopen.models.models import User, Session
+from shopen.middleware.ledger import record_credit, record_credits
+from shopen.middleware.routing import read_db, in_primary_transaction
+from shopen.middleware.versioning import swap, retry_stale
+from shopen.middleware.audit import audit_log
+from shopen.settings import USERS_PAGE_LIMIT, BULK_CREDIT_CHUNK
 
 API_KEY_NAME = "Authorization"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
@@ -30,13 +36,53 @@ async def get_user(id: Optional[int] = None,
 
 
 async def list_users(token: str) -> list[User]:
-    user = await get_user_by_token(token)
-    if user.role != 'admin':
+    await get_admin_by_token(token, "Only admins can list users")
+    return await User.all().using_db(read_db())
+
+
+async def list_user_rows(token: str) -> list[dict]:
+    await get_admin_by_token(token, "Only admins can list users")
+    return await User.all().using_db(read_db()).values('id', 'name', 'role', 'credit')
+
+
+async def search_user_rows(prefix: Optional[str] = None, role: Optional[str] = None,
+                           limit: int = USERS_PAGE_LIMIT, after: Optional[str] = None) -> list[dict]:
+    if not 0 < limit <= USERS_PAGE_LIMIT:
         raise HTTPException(
-            status_code=403,
-            detail="Only admins can list users",
-        )
-    return await User.all()
+            status_code=400,
+            detail=f"Limit must be between 1 and {USERS_PAGE_LIMIT}")
+    # a range on name instead of LIKE, so the name index serves the prefix
+    filters = {}
+    if prefix:
+        filters['name__gte'] = prefix
+        filters['name__lt'] = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    if role is not None:
+        filters['role'] = role
+    query = User.filter(**filters)
+    if after is not None:
+        query = query.filter(name__gt=after)
+    return await query.using_db(read_db()).order_by('name').limit(limit) \
+        .values('id', 'name', 'role', 'credit')
+
+
+async def bulk_set_credit(operation: str, amount: float, user_ids: list[int]) -> dict:
+    updated = 0
+    credited = 0.0
+    missing = []
+    for start in range(0, len(user_ids), BULK_CREDIT_CHUNK):
+        chunk = user_ids[start:start + BULK_CREDIT_CHUNK]
+        async with in_primary_transaction():
+            # previous balances for the ledger, then one UPDATE for the whole chunk
+            balances = {row['id']: row['credit']
+                        for row in await User.filter(id__in=chunk).values('id', 'credit')}
+            credit = amount if operation == 'set' else F('credit') + amount
+            updated += await User.filter(id__in=list(balances)).update(credit=credit, version=F('version') + 1)
+            deltas = {user_id: amount - balance if operation == 'set' else amount
+                      for user_id, balance in balances.items()}
+            await record_credits(deltas)
+        credited += sum(deltas.values())
+        missing += [user_id for user_id in chunk if user_id not in balances]
+    return {"updated": updated, "credited": credited, "missing": missing}
 
 
 async def authenticate(username: str, password: str) -> str:
@@ -74,8 +120,8 @@ async def promote_user(promoter: User, promotee: User) -> None:
     #         status_code=403,
     #         detail="Only admins can promote users",
     #     )
-    promotee.role = 'admin'
-    await promotee.save()
+    await retry_stale(lambda: swap(promotee, role='admin'), promotee)
+    audit_log.record('user.promoted', promoter, f"user:{promotee.id}")
 
 
 async def set_user_credit(supervisor: User, user: User, credit: float) -> None:
@@ -88,19 +134,42 @@ async def set_user_credit(supervisor: User, user: User, credit: float) -> None:
             status_code=400,
             detail="Credit must be non-negative",
         )
-    user.credit = credit
-    await user.save()
+
+    async def set_credit() -> None:
+        delta = credit - user.credit
+        async with in_primary_transaction():
+            await swap(user, credit=credit)
+            await record_credit(user.id, delta)
+
+    await retry_stale(set_credit, user)
+    audit_log.record('user.credit', supervisor, f"user:{user.id}", credit=credit)
+
+
+async def get_admin_by_token(token: str, detail: str = "Only admins can do this") -> User:
+    user = await get_user_by_token(token)
+    if user.role != 'admin':
+        raise HTTPException(
+            status_code=403,
+            detail=detail,
+        )
+    return user
 
 
 async def get_user_by_token(token: str) -> User:
     await clean_sessions()
-    session = await Session.get_or_none(token=token, expiry__gte=datetime.now(timezone.utc))
+    return await get_session_user(token)
+
+
+async def get_session_user(token: str) -> User:
+    # lookup only, for read-only endpoints that must not write
+    session = await Session.filter(token=token, expiry__gte=datetime.now(timezone.utc)) \
+        .using_db(read_db()).select_related('user').first()
     if session is None:
         raise HTTPException(
             status_code=403,
             detail="Could not validate credentials",
         )
-    return await session.user
+    return session.user
 
 
 async def edit_user(supervisor: User, user_id: int,
@@ -112,9 +181,7 @@ async def edit_user(supervisor: User, user_id: int,
                 detail="Username already exists")
 
         user = await get_user(id=user_id)
-        user.name = username
-        user.password = password
-        await user.save()
+        await retry_stale(lambda: swap(user, name=username, password=password), user)
     else:
         raise HTTPException(
             status_code=403,
@@ -127,7 +194,7 @@ async def delete_session(token: str) -> None:
 
 
 async def get_api_key(header: str = Security(api_key_header)) -> str:
-    if await Session.exists(token=header, expiry__gte=datetime.now(timezone.utc)):
+    if await Session.filter(token=header, expiry__gte=datetime.now(timezone.utc)).using_db(read_db()).exists():
         return header
     else:
         raise HTTPException(
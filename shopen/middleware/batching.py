@@ -0,0 +1,70 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+from shopen.middleware.routing import in_primary_transaction
+from shopen.middleware import metrics
+
+
+class WriteBatcher:
+    # group commit: writes submitted within `window` seconds, or until `max_rows`
+    # are queued, run in one db transaction, so they share a single commit
+    def __init__(self, name: str, window: float, max_rows: int):
+        self.name = name
+        self.window = window
+        self.max_rows = max_rows
+        self._pending: list[tuple[Callable[[], Awaitable[Any]], asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def submit(self, write: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((write, future, time.perf_counter()))
+        if len(self._pending) >= self.max_rows:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._schedule_flush)
+        return await future
+
+    def _schedule_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list) -> None:
+        started = time.perf_counter()
+        try:
+            async with in_primary_transaction():
+                results = [await write() for write, _, _ in batch]
+        except Exception:
+            # one failing write must not fail its neighbours, so they commit one by one
+            metrics.inc(f"{self.name}.fallbacks")
+            for write, future, submitted in batch:
+                try:
+                    self._resolve(future, submitted, result=await write())
+                except Exception as e:
+                    self._resolve(future, submitted, error=e)
+        else:
+            for (_, future, submitted), result in zip(batch, results):
+                self._resolve(future, submitted, result=result)
+        metrics.observe(f"{self.name}.size", len(batch))
+        metrics.observe(f"{self.name}.commit_seconds", time.perf_counter() - started)
+
+    def _resolve(self, future: asyncio.Future, submitted: float,
+                 result: Any = None, error: Optional[Exception] = None) -> None:
+        metrics.observe(f"{self.name}.latency_seconds", time.perf_counter() - submitted)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def drain(self) -> None:
+        self._schedule_flush()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
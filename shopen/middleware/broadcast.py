@@ -0,0 +1,91 @@
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from shopen.middleware import metrics
+from shopen.models.models import Pen
+from shopen.settings import STOCK_FEED_COALESCE, STOCK_FEED_KEEPALIVE
+
+
+class Subscriber:
+    # pending keeps only the latest state per pen, so a slow client holds at most
+    # one entry per pen no matter how many updates it missed
+    def __init__(self):
+        self.pending: dict[int, dict] = {}
+        self.ready = asyncio.Event()
+
+    def push(self, delta: dict) -> None:
+        if delta['id'] in self.pending:
+            metrics.inc("stock_feed.coalesced")
+        self.pending[delta['id']] = {**self.pending.get(delta['id'], {}), **delta}
+        self.ready.set()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def drain(self) -> list[dict]:
+        self.ready.clear()
+        deltas = list(self.pending.values())
+        self.pending.clear()
+        return deltas
+
+
+class Broadcaster:
+    def __init__(self):
+        self.subscribers: set[Subscriber] = set()
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        metrics.set_gauge("stock_feed.subscribers", len(self.subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+        metrics.set_gauge("stock_feed.subscribers", len(self.subscribers))
+
+    def publish(self, delta: dict) -> None:
+        for subscriber in self.subscribers:
+            subscriber.push(delta)
+        metrics.inc("stock_feed.published")
+
+
+broadcaster = Broadcaster()
+
+
+async def publish_stock(pen_ids: list[int]) -> None:
+    # reads the committed state only when somebody listens
+    if not broadcaster.subscribers:
+        return
+    for row in await Pen.filter(id__in=pen_ids).values('id', 'stock', 'price', 'is_deleted'):
+        broadcaster.publish({'id': row['id'],
+                             'stock': row['stock'],
+                             'price': row['price'],
+                             'deleted': row['is_deleted']})
+
+
+def _event(name: str, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stock_events(snapshot: Optional[Callable[[], Awaitable[list[dict]]]] = None,
+                       coalesce: float = STOCK_FEED_COALESCE,
+                       keepalive: float = STOCK_FEED_KEEPALIVE) -> AsyncIterator[str]:
+    subscriber = broadcaster.subscribe()
+    try:
+        if snapshot is not None:
+            yield _event("snapshot", await snapshot())
+        while True:
+            if not await subscriber.wait(keepalive):
+                yield ": keepalive\n\n"
+                continue
+            # give rapid updates a moment to fold into one event
+            await asyncio.sleep(coalesce)
+            deltas = subscriber.drain()
+            if deltas:
+                yield _event("stock", deltas)
+    finally:
+        broadcaster.unsubscribe(subscriber)
@@ -0,0 +1,33 @@
+import asyncio
+import time
+from shopen.middleware import metrics
+from shopen.middleware.routing import read_db
+from shopen.models.models import Pen
+from shopen.settings import PEN_SNAPSHOT_TTL
+
+
+class PenSnapshot:
+    # whole catalogue in memory for read-only pricing; writes mark it stale
+    def __init__(self, ttl: float = PEN_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._pens: dict[int, dict] = {}
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+
+    async def pens(self) -> dict[int, dict]:
+        if time.monotonic() < self._expires:
+            metrics.inc("pens.snapshot.hits")
+            return self._pens
+        async with self._lock:
+            if time.monotonic() >= self._expires:
+                rows = await Pen.all().using_db(read_db()).values('id', 'price', 'stock', 'is_deleted')
+                self._pens = {row['id']: row for row in rows}
+                self._expires = time.monotonic() + self.ttl
+                metrics.inc("pens.snapshot.loads")
+        return self._pens
+
+    def invalidate(self) -> None:
+        self._expires = 0.0
+
+
+pen_snapshot = PenSnapshot()
@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from tortoise.models import Model
+from shopen.models.models import Transaction, ArchivedTransaction
+from shopen.settings import EXPORT_CHUNK_SIZE
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_COLUMNS = ['id', 'userId', 'status', 'price', 'timestamp', 'order']
+
+
+async def iter_transactions(start: Optional[datetime] = None,
+                            end: Optional[datetime] = None,
+                            status: Optional[str] = None,
+                            chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[list[dict]]:
+    # the archive holds the older history, then the hot table
+    filters = {}
+    if start is not None:
+        filters['timestamp__gte'] = start
+    if end is not None:
+        filters['timestamp__lt'] = end
+    if status:
+        filters['status'] = status
+    # the indexed month narrows the archive, a day of slack covers time zones of the bounds
+    months = {}
+    if start is not None:
+        months['month__gte'] = (start - timedelta(days=1)).strftime('%Y-%m')
+    if end is not None:
+        months['month__lte'] = (end + timedelta(days=1)).strftime('%Y-%m')
+    async for chunk in _iter_rows(ArchivedTransaction, {**filters, **months}, chunk_size):
+        yield chunk
+    async for chunk in _iter_rows(Transaction, filters, chunk_size):
+        yield chunk
+
+
+async def _iter_rows(model: type[Model], filters: dict, chunk_size: int) -> AsyncIterator[list[dict]]:
+    # keyset pagination by primary key keeps every chunk query cheap and memory flat
+    last_id = 0
+    while True:
+        rows = await model.filter(id__gt=last_id, **filters).order_by('id').limit(chunk_size) \
+            .values('id', 'user_id', 'status', 'price', 'timestamp', 'order')
+        if not rows:
+            return
+        yield [{'id': row['id'],
+                'userId': row['user_id'],
+                'status': row['status'],
+                'price': row['price'],
+                'timestamp': row['timestamp'].isoformat(),
+                'order': row['order']} for row in rows]
+        last_id = rows[-1]['id']
+
+
+async def export_transactions(fmt: str, start: Optional[datetime] = None,
+                              end: Optional[datetime] = None,
+                              status: Optional[str] = None) -> AsyncIterator[bytes]:
+    # fmt is validated by the caller, a generator can not fail before the response starts
+    if fmt == 'csv':
+        yield (','.join(EXPORT_COLUMNS) + '\r\n').encode()
+    async for chunk in iter_transactions(start, end, status):
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in chunk:
+                writer.writerow([row['id'], row['userId'], row['status'], row['price'],
+                                 row['timestamp'], json.dumps(row['order'])])
+            yield buffer.getvalue().encode()
+        else:
+            yield ''.join(json.dumps(row) + '\n' for row in chunk).encode()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
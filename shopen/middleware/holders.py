@@ -0,0 +1,47 @@
+from typing import Optional
+from fastapi import HTTPException
+from shopen.middleware.routing import read_db
+from shopen.middleware.plans import plan_guard
+from shopen.models.models import Holder
+from shopen.settings import HOLDERS_PAGE_LIMIT
+
+HOLDER_FIELDS = ('id', 'pen_id', 'name', 'capacity')
+
+
+def holder_payload(row: dict) -> dict:
+    return {"id": row['id'],
+            "penId": row['pen_id'],
+            "name": row['name'],
+            "capacity": row['capacity']}
+
+
+async def list_holders(pen_ids: Optional[list[int]] = None,
+                       min_capacity: Optional[int] = None,
+                       max_capacity: Optional[int] = None,
+                       limit: int = HOLDERS_PAGE_LIMIT,
+                       offset: int = 0) -> list[dict]:
+    if not 0 < limit <= HOLDERS_PAGE_LIMIT or offset < 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Limit must be between 1 and {HOLDERS_PAGE_LIMIT}, offset must be non-negative")
+    filters = {}
+    if pen_ids:
+        filters['pen_id__in'] = pen_ids
+    if min_capacity is not None:
+        filters['capacity__gte'] = min_capacity
+    if max_capacity is not None:
+        filters['capacity__lte'] = max_capacity
+    return await Holder.filter(**filters).using_db(read_db()) \
+        .order_by('id').offset(offset).limit(limit).values(*HOLDER_FIELDS)
+
+
+async def holders_by_pen(pen_ids: list[int]) -> dict[int, list[dict]]:
+    # one query for a whole page of pens
+    grouped: dict[int, list[dict]] = {pen_id: [] for pen_id in pen_ids}
+    if not pen_ids:
+        return grouped
+    plan_guard.note_include()
+    for row in await Holder.filter(pen_id__in=pen_ids).using_db(read_db()) \
+            .order_by('id').values(*HOLDER_FIELDS):
+        grouped[row['pen_id']].append(holder_payload(row))
+    return grouped
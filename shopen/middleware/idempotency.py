@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from fastapi import HTTPException
+from fastapi.responses import Response
+from shopen.middleware import metrics
+from shopen.settings import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyStore:
+    def __init__(self, size: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, int, bytes, str]] = OrderedDict()
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    def get(self, key: str) -> Optional[tuple[int, bytes, str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, status_code, body, fingerprint = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return status_code, body, fingerprint
+
+    def put(self, key: str, status_code: int, body: bytes, fingerprint: str = '') -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, status_code, body, fingerprint)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            metrics.inc("idempotency.evicted")
+
+    def lock(self, key: str) -> asyncio.Lock:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        return lock
+
+    def unlock(self, key: str) -> None:
+        lock, users = self._locks[key]
+        if users == 1:
+            del self._locks[key]
+        else:
+            self._locks[key] = (lock, users - 1)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+store = IdempotencyStore()
+
+
+def fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def _replay(status_code: int, body: bytes, stored: str, requested: str) -> Response:
+    # a key reused for a different request must not silently answer for the first one
+    if stored != requested:
+        metrics.inc("idempotency.mismatched")
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used with a different request body")
+    return Response(content=body, status_code=status_code,
+                    media_type="application/json", headers={REPLAY_HEADER: "true"})
+
+
+async def idempotent(key: Optional[str], scope: str,
+                     handler: Callable[[], Awaitable[Response]], body: bytes = b'') -> Response:
+    # only successful responses are stored, failed attempts may be retried for real
+    if not key:
+        return await handler()
+    key = f"{scope}:{key}"
+    requested = fingerprint(body)
+    cached = store.get(key)
+    if cached is not None:
+        metrics.inc("idempotency.replayed")
+        return _replay(*cached, requested)
+    lock = store.lock(key)
+    try:
+        async with lock:
+            cached = store.get(key)
+            if cached is not None:
+                metrics.inc("idempotency.replayed")
+                return _replay(*cached, requested)
+            response = await handler()
+            if response.status_code < 400:
+                store.put(key, response.status_code, response.body, requested)
+            return response
+    finally:
+        store.unlock(key)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+from shopen.middleware import metrics
+from shopen.middleware.pens import expire_transactions, count_expired_transactions, archive_transactions
+from shopen.middleware.outbox import outbox
+from shopen.middleware.snapshots import save_snapshot
+from shopen.settings import (TRANSACTION_EXPIRY_INTERVAL, ARCHIVE_INTERVAL, OUTBOX_INTERVAL,
+                             DB_MEMORY, DB_SNAPSHOT_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+_tasks: list[asyncio.Task] = []
+
+
+async def run_periodic(job: Callable[[], Awaitable[None]], interval: float) -> None:
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Background job %s failed", job.__name__)
+        await asyncio.sleep(interval)
+
+
+def start_job(job: Callable[[], Awaitable[None]], interval: float) -> asyncio.Task:
+    task = asyncio.create_task(run_periodic(job, interval), name=job.__name__)
+    _tasks.append(task)
+    return task
+
+
+async def stop_jobs() -> None:
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+async def expiry_job() -> None:
+    started = time.perf_counter()
+    backlog = await count_expired_transactions()
+    metrics.set_gauge("transactions.expiry.backlog", backlog)
+    if backlog:
+        cancelled = await expire_transactions()
+        metrics.inc("transactions.expiry.cancelled", cancelled)
+    metrics.observe("transactions.expiry.sweep_seconds", time.perf_counter() - started)
+
+
+async def archive_job() -> None:
+    started = time.perf_counter()
+    metrics.inc("transactions.archive.moved", await archive_transactions())
+    metrics.observe("transactions.archive.sweep_seconds", time.perf_counter() - started)
+
+
+async def outbox_job() -> None:
+    started = time.perf_counter()
+    await outbox.dispatch()
+    metrics.observe("outbox.dispatch_seconds", time.perf_counter() - started)
+
+
+async def outbox_purge_job() -> None:
+    metrics.inc("outbox.purged", await outbox.purge())
+
+
+async def snapshot_job() -> None:
+    await save_snapshot()
+
+
+def start_background_jobs() -> None:
+    if TRANSACTION_EXPIRY_INTERVAL > 0:
+        start_job(expiry_job, TRANSACTION_EXPIRY_INTERVAL)
+    if ARCHIVE_INTERVAL > 0:
+        start_job(archive_job, ARCHIVE_INTERVAL)
+    if outbox.sink is not None:
+        start_job(outbox_job, OUTBOX_INTERVAL)
+        start_job(outbox_purge_job, ARCHIVE_INTERVAL)
+    if DB_MEMORY and DB_SNAPSHOT_INTERVAL > 0:
+        start_job(snapshot_job, DB_SNAPSHOT_INTERVAL)
@@ -0,0 +1,99 @@
+from datetime import date, datetime, timezone
+from typing import Optional
+from fastapi import HTTPException
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.models import Model
+from shopen.models.models import LedgerEntry, UserSpend, PenSales, DailyRevenue, TransactionLine
+
+
+async def _bump(model: type[Model], key: dict, **deltas) -> None:
+    # upsert of additive counters; callers run it inside their db transaction
+    updates = {name: F(name) + value for name, value in deltas.items()}
+    if await model.filter(**key).update(**updates):
+        return
+    try:
+        await model.create(**key, **deltas)
+    except IntegrityError:
+        await model.filter(**key).update(**updates)
+
+
+async def record_purchase(user_id: int, transaction_id: int,
+                          charged: float, lines: list[TransactionLine]) -> None:
+    entries = [LedgerEntry(kind='purchase', user_id=user_id,
+                           transaction_id=transaction_id, credit=-charged)]
+    entries += [LedgerEntry(kind='purchase', pen_id=line.pen_id,
+                            transaction_id=transaction_id, stock=-line.number)
+                for line in lines]
+    await LedgerEntry.bulk_create(entries)
+    await _bump(UserSpend, {'user_id': user_id}, spent=charged, transactions=1)
+    for line in lines:
+        await _bump(PenSales, {'pen_id': line.pen_id}, units=line.number)
+    await _bump(DailyRevenue, {'day': datetime.now(timezone.utc).date()},
+                revenue=charged, transactions=1)
+
+
+async def record_refund(user_id: int, transaction_id: int,
+                        refunded: float, lines: list[TransactionLine]) -> None:
+    # the aggregates take back what the purchase booked, on the day it was booked;
+    # the credit entry keeps what actually went back to the user
+    purchase = await LedgerEntry.filter(kind='purchase', transaction_id=transaction_id,
+                                        user_id__isnull=False).first()
+    if purchase is not None:
+        charged, day = -purchase.credit, purchase.timestamp.astimezone(timezone.utc).date()
+    else:
+        charged, day = refunded, datetime.now(timezone.utc).date()
+    entries = [LedgerEntry(kind='refund', user_id=user_id,
+                           transaction_id=transaction_id, credit=refunded)]
+    entries += [LedgerEntry(kind='refund', pen_id=line.pen_id,
+                            transaction_id=transaction_id, stock=line.number)
+                for line in lines]
+    await LedgerEntry.bulk_create(entries)
+    await _bump(UserSpend, {'user_id': user_id}, spent=-charged, transactions=-1)
+    for line in lines:
+        await _bump(PenSales, {'pen_id': line.pen_id}, units=-line.number)
+    await _bump(DailyRevenue, {'day': day}, revenue=-charged, transactions=-1)
+
+
+async def record_restock(pen_id: int, units: int) -> None:
+    await LedgerEntry.create(kind='restock', pen_id=pen_id, stock=units)
+
+
+async def record_initial_stock(pen_id: int, units: int) -> None:
+    await LedgerEntry.create(kind='initial', pen_id=pen_id, stock=units)
+
+
+async def record_removal(pen_id: int, units: int) -> None:
+    # stock written off when a pen is deleted
+    await LedgerEntry.create(kind='removal', pen_id=pen_id, stock=-units)
+
+
+async def record_credit(user_id: int, delta: float) -> None:
+    await LedgerEntry.create(kind='credit', user_id=user_id, credit=delta)
+
+
+async def record_credits(deltas: dict[int, float]) -> None:
+    await LedgerEntry.bulk_create([LedgerEntry(kind='credit', user_id=user_id, credit=delta)
+                                   for user_id, delta in deltas.items() if delta])
+
+
+async def get_user_spend(user_id: int) -> UserSpend:
+    return await UserSpend.get_or_none(user_id=user_id) or UserSpend(user_id=user_id)
+
+
+async def get_pen_sales(pen_id: int) -> PenSales:
+    return await PenSales.get_or_none(pen_id=pen_id) or PenSales(pen_id=pen_id)
+
+
+async def list_daily_revenue(start: Optional[date] = None,
+                             end: Optional[date] = None) -> list[DailyRevenue]:
+    if start is not None and end is not None and start > end:
+        raise HTTPException(
+            status_code=400,
+            detail="Start date must not be after end date")
+    filters = {}
+    if start is not None:
+        filters['day__gte'] = start
+    if end is not None:
+        filters['day__lte'] = end
+    return await DailyRevenue.filter(**filters).order_by('day')
@@ -0,0 +1,58 @@
+import json
+from fastapi import HTTPException
+from shopen.settings import MAX_BODY_BYTES, BODY_LIMITS
+
+
+class BodyTooLarge(HTTPException):
+    # an HTTPException, so FastAPI's body parsing re-raises it instead of answering 400
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"Request body is larger than {max_bytes} bytes")
+
+
+class BodySizeLimit:
+    # rejects oversized bodies before the route parses them or touches the db
+    def __init__(self, app, max_bytes: int = MAX_BODY_BYTES, limits: dict[str, int] = BODY_LIMITS):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits  # per path overrides
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        max_bytes = self.limits.get(scope['path'], self.max_bytes)
+        headers = dict(scope['headers'])
+        length = headers.get(b'content-length')
+        if length is not None and length.isdigit() and int(length) > max_bytes:
+            return await self._reject(send, max_bytes)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > max_bytes:
+                    raise BodyTooLarge(max_bytes)
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge:
+            if not started:
+                await self._reject(send, max_bytes)
+
+    async def _reject(self, send, max_bytes: int) -> None:
+        body = json.dumps({"message": BodyTooLarge(max_bytes).detail}).encode()
+        await send({'type': 'http.response.start',
+                    'status': 413,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
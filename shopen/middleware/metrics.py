@@ -0,0 +1,51 @@
+from collections import defaultdict, deque
+
+SAMPLES_LIMIT = 1024
+
+_counters: dict[str, float] = defaultdict(float)
+_gauges: dict[str, float] = {}
+_samples: dict[str, deque] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    if name not in _samples:
+        _samples[name] = deque(maxlen=SAMPLES_LIMIT)
+    _samples[name].append(value)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def snapshot() -> dict:
+    summaries = {}
+    for name, samples in _samples.items():
+        values = list(samples)
+        summaries[name] = {
+            "count": len(values),
+            "last": values[-1] if values else 0.0,
+            "max": max(values, default=0.0),
+            "p50": percentile(values, 0.5),
+            "p99": percentile(values, 0.99),
+        }
+    return {"counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "summaries": summaries}
+
+
+def reset() -> None:
+    _counters.clear()
+    _gauges.clear()
+    _samples.clear()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Protocol
+from shopen.middleware import metrics
+from shopen.models.models import OutboxEvent
+from shopen.settings import (OUTBOX_SINK, OUTBOX_BATCH, OUTBOX_BACKOFF, OUTBOX_BACKOFF_MAX,
+                             OUTBOX_WEBHOOK_TIMEOUT, OUTBOX_RETENTION)
+
+ERROR_LIMIT = 500
+
+
+class Sink(Protocol):
+    async def deliver(self, events: list[dict]) -> None: ...
+
+
+class FileSink:
+    # one json document per line, appended
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, events: list[dict]) -> None:
+        with open(self.path, 'a') as file:
+            file.writelines(json.dumps(event) + '\n' for event in events)
+
+    async def deliver(self, events: list[dict]) -> None:
+        await asyncio.to_thread(self._write, events)
+
+
+class WebhookSink:
+    # the whole batch in one POST, any non-2xx answer fails it
+    def __init__(self, url: str, timeout: float = OUTBOX_WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def _post(self, events: list[dict]) -> None:
+        request = urllib.request.Request(self.url, data=json.dumps({"events": events}).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if not 200 <= response.status < 300:
+                raise RuntimeError(f"Webhook answered {response.status}")
+
+    async def deliver(self, events: list[dict]) -> None:
+        await asyncio.to_thread(self._post, events)
+
+
+class QueueSink:
+    # in-process consumers; a full queue fails the batch so it is retried later
+    def __init__(self, maxsize: int = 10_000):
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize)
+
+    async def deliver(self, events: list[dict]) -> None:
+        if self.queue.maxsize and self.queue.qsize() + len(events) > self.queue.maxsize:
+            raise RuntimeError("Queue is full")
+        for event in events:
+            self.queue.put_nowait(event)
+
+
+def sink_from_setting(setting: str) -> Optional[Sink]:
+    kind, _, target = setting.partition(':')
+    if not kind:
+        return None
+    if kind == 'file':
+        return FileSink(target or 'outbox.jsonl')
+    if kind == 'webhook':
+        return WebhookSink(target)
+    if kind == 'queue':
+        return QueueSink()
+    raise ValueError(f"Unknown outbox sink {setting!r}")
+
+
+def _event(row: OutboxEvent) -> dict:
+    return {"id": row.id,
+            "kind": row.kind,
+            "createdAt": row.created_at.isoformat(),
+            "payload": row.payload}
+
+
+def backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+class Outbox:
+    def __init__(self, sink: Optional[Sink] = None, batch: int = OUTBOX_BATCH):
+        self.sink = sink
+        self.batch = batch
+
+    async def emit(self, kind: str, payload: dict) -> None:
+        # callers run it inside their db transaction, so the event commits or rolls back with it
+        if self.sink is None:
+            return
+        await OutboxEvent.create(kind=kind, payload=payload)
+
+    async def _deliver_batch(self) -> int:
+        now = datetime.now(timezone.utc)
+        rows = await OutboxEvent.filter(delivered=False) \
+            .filter(next_attempt_at__isnull=True).order_by('id').limit(self.batch)
+        if len(rows) < self.batch:
+            rows += await OutboxEvent.filter(delivered=False, next_attempt_at__lte=now) \
+                .order_by('id').limit(self.batch - len(rows))
+        if not rows:
+            return 0
+        ids = [row.id for row in rows]
+        try:
+            await self.sink.deliver([_event(row) for row in rows])
+        except Exception as e:
+            metrics.inc("outbox.failed", len(rows))
+            # one retry schedule for the batch, driven by its most retried event
+            attempts = max(row.attempts for row in rows) + 1
+            await OutboxEvent.filter(id__in=ids).update(
+                attempts=attempts,
+                next_attempt_at=now + timedelta(seconds=backoff(attempts)),
+                last_error=repr(e)[:ERROR_LIMIT])
+            return 0
+        await OutboxEvent.filter(id__in=ids).update(delivered=True, last_error=None)
+        metrics.inc("outbox.delivered", len(rows))
+        return len(rows)
+
+    async def dispatch(self) -> int:
+        if self.sink is None:
+            return 0
+        delivered = 0
+        while True:
+            sent = await self._deliver_batch()
+            delivered += sent
+            if sent < self.batch:
+                break
+        metrics.set_gauge("outbox.backlog", await OutboxEvent.filter(delivered=False).count())
+        return delivered
+
+    async def purge(self) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=OUTBOX_RETENTION)
+        return await OutboxEvent.filter(delivered=True, created_at__lt=cutoff).delete()
+
+
+outbox = Outbox(sink_from_setting(OUTBOX_SINK))
@@ -1,23 +1,45 @@
 from typing import Optional
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
-from tortoise.transactions import in_transaction
-from shopen.models.models import User, Pen, Transaction
+from tortoise.expressions import F
+from shopen.models.models import (User, Pen, Transaction, TransactionLine,
+                                   ArchivedTransaction, ArchivedTransactionLine)
 from shopen.models.schemas import TransactionRequest
+from shopen.middleware.reservations import reservations
+from shopen.middleware.ledger import (record_purchase, record_refund, record_restock,
+                                      record_initial_stock, record_removal)
+from shopen.middleware.broadcast import publish_stock
+from shopen.middleware.batching import WriteBatcher
+from shopen.middleware.routing import read_db, in_primary_transaction
+from shopen.middleware.plans import plan_guard
+from shopen.middleware.catalogue import pen_snapshot
+from shopen.middleware.versioning import swap, retry_stale
+from shopen.middleware.outbox import outbox
+from shopen.middleware.audit import audit_log
 from shopen.settings import (ADMIN_DISCOUNT, WHOLESALE_DISCOUNT,
                              WHOLESALE_THRESHOLD,
                              TRANSACTION_REQUEST_THRESHOLD,
-                             TRANSACTION_REFUND_THRESHOLD)
+                             TRANSACTION_REFUND_THRESHOLD,
+                             TRANSACTION_EXPIRY_BATCH,
+                             STOCK_RESERVATION,
+                             ARCHIVE_BATCH,
+                             TRANSACTION_BATCH_WINDOW,
+                             TRANSACTION_BATCH_MAX_ROWS)
 
+transaction_writes = WriteBatcher('transactions.batch', TRANSACTION_BATCH_WINDOW, TRANSACTION_BATCH_MAX_ROWS)
 
-async def list_pens(
-        brand: Optional[list[str]] = None,
-        min_price: Optional[float] = None,
-        max_price: Optional[float] = None,
-        min_stock: Optional[float] = None,
-        color: Optional[list[str]] = None,
-        min_length: Optional[float] = None,
-        max_length: Optional[float] = None) -> list[Pen]:
+
+PEN_FIELDS = ('id', 'brand', 'price', 'stock', 'color', 'length')
+TRANSACTION_FIELDS = ('id', 'user_id', 'status', 'price', 'timestamp', 'order')
+
+
+def _pen_filters(brand: Optional[list[str]] = None,
+                 min_price: Optional[float] = None,
+                 max_price: Optional[float] = None,
+                 min_stock: Optional[float] = None,
+                 color: Optional[list[str]] = None,
+                 min_length: Optional[float] = None,
+                 max_length: Optional[float] = None) -> dict:
     filters = {"is_deleted": False}
 
     if brand:
@@ -34,11 +56,36 @@ async def list_pens(
         filters["length__gte"] = min_length
     if max_length is not None:
         filters["length__lte"] = max_length
-    return await Pen.filter(**filters)
+    return filters
+
+
+async def list_pens(
+        brand: Optional[list[str]] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_stock: Optional[float] = None,
+        color: Optional[list[str]] = None,
+        min_length: Optional[float] = None,
+        max_length: Optional[float] = None) -> list[Pen]:
+    filters = _pen_filters(brand, min_price, max_price, min_stock, color, min_length, max_length)
+    return await Pen.filter(**filters).using_db(read_db())
+
+
+async def list_pen_rows(
+        brand: Optional[list[str]] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_stock: Optional[float] = None,
+        color: Optional[list[str]] = None,
+        min_length: Optional[float] = None,
+        max_length: Optional[float] = None) -> list[dict]:
+    # plain dicts, no model instances are built for listings
+    filters = _pen_filters(brand, min_price, max_price, min_stock, color, min_length, max_length)
+    return await Pen.filter(**filters).using_db(read_db()).values(*PEN_FIELDS)
 
 
 async def get_pen(id: int) -> Pen:
-    pen = await Pen.get_or_none(id=id)
+    pen = await Pen.get_or_none(id=id, using_db=read_db())
     if pen is None:
         raise HTTPException(
             status_code=404,
@@ -53,8 +100,14 @@ async def add_pen(user: User, brand: str, price: float,
         raise HTTPException(
             status_code=403,
             detail="Only admins can add pens")
-    return await Pen.create(brand=brand, price=price, stock=stock,
-                            color=color, length=length)
+    async with in_primary_transaction():
+        pen = await Pen.create(brand=brand, price=price, stock=stock,
+                               color=color, length=length)
+        await record_initial_stock(pen.id, stock)
+    audit_log.record('pen.added', user, f"pen:{pen.id}", brand=brand, price=price, stock=stock)
+    pen_snapshot.invalidate()
+    await publish_stock([pen.id])
+    return pen
 
 
 async def restock_pen(user: User, pen_id: int, stock: int) -> Pen:
@@ -62,9 +115,19 @@ async def restock_pen(user: User, pen_id: int, stock: int) -> Pen:
         raise HTTPException(
             status_code=403,
             detail="Only admins can restock pens")
-    pen = await get_pen(pen_id)
-    pen.stock += stock
-    await pen.save()
+
+    async def restock() -> Pen:
+        pen = await get_pen(pen_id)
+        async with in_primary_transaction():
+            await swap(pen, stock=pen.stock + stock)
+            await record_restock(pen.id, stock)
+            await outbox.emit('pen.restocked', {"penId": pen.id, "units": stock, "stock": pen.stock})
+        return pen
+
+    pen = await retry_stale(restock)
+    audit_log.record('pen.restocked', user, f"pen:{pen.id}", units=stock, stock=pen.stock)
+    pen_snapshot.invalidate()
+    await publish_stock([pen.id])
     return pen
 
 
@@ -73,21 +136,33 @@ async def delete_pen(user: User, pen_id: int) -> None:
         raise HTTPException(
             status_code=403,
             detail="Only admins can delete pens")
-    pen = await get_pen(pen_id)
-    pen.is_deleted = True
-    pen.stock = 0
-    await pen.save()
 
+    async def delete() -> Pen:
+        pen = await get_pen(pen_id)
+        removed = pen.stock
+        async with in_primary_transaction():
+            await swap(pen, is_deleted=True, stock=0)
+            if removed:
+                await record_removal(pen.id, removed)
+            await outbox.emit('pen.deleted', {"penId": pen.id})
+        return pen
+
+    pen = await retry_stale(delete)
+    audit_log.record('pen.deleted', user, f"pen:{pen.id}")
+    pen_snapshot.invalidate()
+    await publish_stock([pen.id])
 
-async def get_transaction(user: User, id: int) -> Transaction:
+
+async def get_transaction(user: User, id: int) -> Transaction | ArchivedTransaction:
     transaction = await Transaction.get_or_none(id=id)
+    if transaction is None:
+        transaction = await ArchivedTransaction.get_or_none(id=id)
     if transaction is None:
         raise HTTPException(
             status_code=404,
             detail="Transaction not found",
         )
-    transaction_user = await transaction.user.get()
-    if user.role == 'admin' or transaction_user.id == user.id:
+    if user.role == 'admin' or transaction.user_id == user.id:
         return transaction
     else:
         raise HTTPException(
@@ -95,45 +170,187 @@ async def get_transaction(user: User, id: int) -> Transaction:
             detail="Only admins can view other users' transactions")
 
 
-async def list_transactions(user: User, show_own=True, status: Optional[str] = None) -> list[Transaction]:
+def _transaction_filters(user: User, show_own=True, status: Optional[str] = None) -> dict:
     filter = {}
     if show_own or user.role != 'admin':
-        filter['user'] = user
+        filter['user_id'] = user.id
     if status:
         filter['status'] = status
+    return filter
+
+
+# archived transactions first, they are the older ones
+async def list_transactions(user: User, show_own=True,
+                            status: Optional[str] = None) -> list[Transaction | ArchivedTransaction]:
+    filters = _transaction_filters(user, show_own, status)
+    return await ArchivedTransaction.filter(**filters).using_db(read_db()) + \
+        await Transaction.filter(**filters).using_db(read_db())
+
 
-    return await Transaction.filter(**filter)
+async def list_transaction_rows(user: User, show_own=True, status: Optional[str] = None) -> list[dict]:
+    filters = _transaction_filters(user, show_own, status)
+    return await ArchivedTransaction.filter(**filters).using_db(read_db()).values(*TRANSACTION_FIELDS) + \
+        await Transaction.filter(**filters).using_db(read_db()).values(*TRANSACTION_FIELDS)
+
+
+def _request_deadline() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(minutes=TRANSACTION_REQUEST_THRESHOLD)
+
+
+async def count_expired_transactions() -> int:
+    return await Transaction.filter(status='requested',
+                                    timestamp__lt=_request_deadline()).count()
+
+
+async def expire_transactions(batch_size: int = TRANSACTION_EXPIRY_BATCH) -> int:
+    deadline = _request_deadline()
+    expired = 0
+    while True:
+        ids = await Transaction.filter(status='requested', timestamp__lt=deadline) \
+            .order_by('timestamp').limit(batch_size).values_list('id', flat=True)
+        if not ids:
+            break
+        expired += await Transaction.filter(id__in=ids, status='requested').update(status='cancelled')
+        for transaction_id in ids:
+            reservations.release(transaction_id)
+        if len(ids) < batch_size:
+            break
+    return expired
+
+
+async def archive_transactions(batch_size: int = ARCHIVE_BATCH) -> int:
+    # nothing can happen to a finished transaction after the refund window
+    deadline = datetime.now(timezone.utc) - timedelta(minutes=TRANSACTION_REFUND_THRESHOLD)
+    archived = 0
+    while True:
+        rows = await Transaction.filter(timestamp__lt=deadline, status__in=['completed', 'cancelled', 'refunded']) \
+            .order_by('id').limit(batch_size) \
+            .values('id', 'user_id', 'price', 'timestamp', 'order', 'status')
+        if not rows:
+            return archived
+        ids = [row['id'] for row in rows]
+        async with in_primary_transaction():
+            await ArchivedTransaction.bulk_create([
+                ArchivedTransaction(**row, month=row['timestamp'].strftime('%Y-%m')) for row in rows])
+            # copied before the delete below cascades to them
+            lines = await TransactionLine.filter(transaction_id__in=ids).values('transaction_id', 'pen_id', 'number')
+            await ArchivedTransactionLine.bulk_create([ArchivedTransactionLine(**line) for line in lines])
+            await Transaction.filter(id__in=ids).delete()
+        archived += len(rows)
+        if len(rows) < batch_size:
+            return archived
+
+
+async def create_transaction(user: User, price: float, order: list[dict]) -> Transaction:
+    if TRANSACTION_BATCH_WINDOW > 0:
+        return await transaction_writes.submit(lambda: insert_transaction(user, price, order))
+    return await insert_transaction(user, price, order)
+
+
+async def insert_transaction(user: User, price: float, order: list[dict]) -> Transaction:
+    async with in_primary_transaction():
+        transaction = await Transaction.create(user=user, price=price, order=order)
+        await TransactionLine.bulk_create([
+            TransactionLine(transaction=transaction, pen_id=line['penId'], number=line['number'])
+            for line in order])
+    return transaction
+
+
+def discounted_price(user: User, total_price: float) -> float:
+    if user.role == 'admin':
+        return total_price * (1 - ADMIN_DISCOUNT)
+    elif total_price > WHOLESALE_THRESHOLD:
+        return total_price * (1 - WHOLESALE_DISCOUNT)
+    return total_price
+
+
+async def quote_pens(user: User, invoice: TransactionRequest) -> dict:
+    # priced from the in-memory snapshot, nothing is written
+    pens = await pen_snapshot.pens()
+    lines = []
+    subtotal = 0.0
+    for pen_request in invoice.order:
+        pen = pens.get(pen_request.id)
+        if pen is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Pen not found",
+            )
+        stock = reservations.available(pen['id'], pen['stock'])
+        lines.append({'penId': pen['id'],
+                      'number': pen_request.count,
+                      'unitPrice': pen['price'],
+                      'price': pen['price'] * pen_request.count,
+                      'stock': stock,
+                      'available': stock >= pen_request.count})
+        subtotal += pen['price'] * pen_request.count
+    price = discounted_price(user, subtotal)
+    return {'lines': lines,
+            'subtotal': subtotal,
+            'discount': subtotal - price,
+            'price': price,
+            'available': all(line['available'] for line in lines),
+            'enoughCredit': user.credit >= subtotal}
 
 
 async def request_pens(user: User, invoice: TransactionRequest) -> Transaction:
     total_price = 0.0
+    stock, needed = {}, {}
+    # lines are unique per pen after validation, so all pens come in one query
+    pens = {pen.id: pen for pen in await Pen.filter(id__in=[line.id for line in invoice.order])}
     for pen_request in invoice.order:
-        pen = await get_pen(pen_request.id)
+        pen = pens.get(pen_request.id)
+        if pen is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Pen not found",
+            )
         if pen.stock < pen_request.count:
             raise HTTPException(
                 status_code=400,
                 detail="Not enough stock")
         total_price += pen.price * pen_request.count
+        stock[pen.id] = pen.stock
+        needed[pen.id] = needed.get(pen.id, 0) + pen_request.count
 
     if user.credit < total_price:
         raise HTTPException(
             status_code=400,
             detail="Not enough credit")
 
-    if user.role == 'admin':
-        total_price = total_price * (1 - ADMIN_DISCOUNT)
-    elif total_price > WHOLESALE_THRESHOLD:
-        total_price = total_price * (1 - WHOLESALE_DISCOUNT)
+    total_price = discounted_price(user, total_price)
     order = []
     for pen in invoice.order:
         order.append({'penId': pen.id, 'number': pen.count})
-    return await Transaction.create(user=user, price=total_price, order=order)
+
+    if not STOCK_RESERVATION:
+        return await create_transaction(user, total_price, order)
+
+    hold = object()
+    if not reservations.reserve(hold, needed, stock):
+        raise HTTPException(
+            status_code=400,
+            detail="Not enough stock")
+    try:
+        transaction = await create_transaction(user, total_price, order)
+    except BaseException:
+        reservations.release(hold)
+        raise
+    reservations.rekey(hold, transaction.id)
+    return transaction
+
+
+def _transaction_event(transaction: Transaction, user: User,
+                       amount: float, lines: list[TransactionLine]) -> dict:
+    return {"transactionId": transaction.id,
+            "userId": user.id,
+            "amount": amount,
+            "order": [{"penId": line.pen_id, "number": line.number} for line in lines]}
 
 
 async def complete_transaction(user: User, transaction_id: int) -> None:
     transaction = await get_transaction(user, transaction_id)
-    transaction_user = await transaction.user.get()
-    if user.id != transaction_user.id:
+    if user.id != transaction.user_id:
         raise HTTPException(
             status_code=403,
             detail="You can only complete your own transactions")
@@ -144,32 +361,65 @@ async def complete_transaction(user: User, transaction_id: int) -> None:
     if (datetime.now(timezone.utc) - transaction.timestamp).seconds > TRANSACTION_REQUEST_THRESHOLD * 60:
         transaction.status = 'cancelled'
         await transaction.save()
+        reservations.release(transaction.id)
         raise HTTPException(
             status_code=400,
             detail="Transaction request is expired and will be cancelled")
 
-    async with in_transaction():
-        try:
+    # reserved stock is already guaranteed, so it is taken without re-reading the pens
+    reserved = transaction.id in reservations
+    lines = await TransactionLine.filter(transaction_id=transaction.id)
+    plan_guard.note_lines(len(lines))
+
+    async def take_and_charge() -> float:
+        pens = {}
+        if not reserved:
+            pens = {pen.id: pen for pen in await Pen.filter(id__in=[line.pen_id for line in lines])}
+        charged = 0.0
+        async with in_primary_transaction():
+            # the status is claimed in the db transaction, a racing complete finds nothing to update
+            if not await Transaction.filter(id=transaction.id, status='requested').update(status='completed'):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Transaction is already processed")
             transaction.status = 'completed'
-            await transaction.save()
-            for pen_request in transaction.order:
-                pen = await Pen.get(id=pen_request['penId'])
-                if pen.stock < pen_request['number']:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Not enough stock. Transaction will be cancelled")
-                pen.stock -= pen_request['number']
-                await pen.save()
-                if user.credit < transaction.price:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Not enough credit. Transaction will be cancelled")
-                user.credit -= transaction.price
-                await user.save()
-        except HTTPException as e:
-            transaction.status = 'cancelled'
-            await transaction.save()
-            raise e
+            try:
+                for line in lines:
+                    if reserved:
+                        taken = await Pen.filter(id=line.pen_id, stock__gte=line.number) \
+                            .update(stock=F('stock') - line.number, version=F('version') + 1)
+                        if not taken:
+                            raise HTTPException(
+                                status_code=400,
+                                detail="Not enough stock. Transaction will be cancelled")
+                    else:
+                        pen = pens[line.pen_id]
+                        if pen.stock < line.number:
+                            raise HTTPException(
+                                status_code=400,
+                                detail="Not enough stock. Transaction will be cancelled")
+                        await swap(pen, stock=pen.stock - line.number)
+                    if user.credit < transaction.price:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="Not enough credit. Transaction will be cancelled")
+                    await swap(user, credit=user.credit - transaction.price)
+                    charged += transaction.price
+                await record_purchase(user.id, transaction.id, charged, lines)
+                await outbox.emit('transaction.completed', _transaction_event(transaction, user, charged, lines))
+            except HTTPException as e:
+                transaction.status = 'cancelled'
+                await transaction.save()
+                reservations.release(transaction.id)
+                raise e
+        return charged
+
+    charged = await retry_stale(take_and_charge, user)
+    # the credit actually taken, not the transaction price
+    audit_log.record('transaction.completed', user, f"transaction:{transaction.id}", charged=charged)
+    reservations.commit(transaction.id)
+    pen_snapshot.invalidate()
+    await publish_stock([line.pen_id for line in lines])
 
 
 async def cancel_transaction(user: User, transaction_id: int) -> None:
@@ -186,12 +436,12 @@ async def cancel_transaction(user: User, transaction_id: int) -> None:
             detail="Transaction is already processed")
     transaction.status = 'cancelled'
     await transaction.save()
+    reservations.release(transaction.id)
 
 
 async def refund_transaction(user: User, transaction_id: int) -> None:
     transaction = await get_transaction(user, transaction_id)
-    transaction_user = await transaction.user.get()
-    if user.id != transaction_user.id:
+    if user.id != transaction.user_id:
         raise HTTPException(
             status_code=403,
             detail="You can only refund your own transactions")
@@ -199,17 +449,33 @@ async def refund_transaction(user: User, transaction_id: int) -> None:
         raise HTTPException(
             status_code=400,
             detail="Transaction is not completed")
+    if isinstance(transaction, ArchivedTransaction):
+        raise HTTPException(
+            status_code=400,
+            detail="Transaction is archived and cannot be refunded")
     if (datetime.now(timezone.utc) - transaction.timestamp).seconds > TRANSACTION_REFUND_THRESHOLD * 60:
         raise HTTPException(
             status_code=400,
             detail="Transaction request is expired and cannot be refunded")
 
-    async with in_transaction():
-        transaction.status = 'refunded'
-        await transaction.save()
-        for pen_request in transaction.order:
-            pen = await Pen.get(id=pen_request['penId'])
-            pen.stock += pen_request['number']
-            await pen.save()
-        user.credit += transaction.price
-        await user.save()
+    lines = await TransactionLine.filter(transaction_id=transaction.id)
+
+    async def restore_and_credit() -> None:
+        async with in_primary_transaction():
+            if not await Transaction.filter(id=transaction.id, status='completed').update(status='refunded'):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Transaction is not completed")
+            transaction.status = 'refunded'
+            for line in lines:
+                await Pen.filter(id=line.pen_id).update(stock=F('stock') + line.number,
+                                                        version=F('version') + 1)
+            await swap(user, credit=user.credit + transaction.price)
+            await record_refund(user.id, transaction.id, transaction.price, lines)
+            await outbox.emit('transaction.refunded',
+                              _transaction_event(transaction, user, transaction.price, lines))
+
+    await retry_stale(restore_and_credit, user)
+    audit_log.record('transaction.refunded', user, f"transaction:{transaction.id}", price=transaction.price)
+    pen_snapshot.invalidate()
+    await publish_stock([line.pen_id for line in lines])
@@ -0,0 +1,107 @@
+import logging
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+from shopen.middleware import metrics
+
+logger = logging.getLogger(__name__)
+
+VIOLATIONS_LIMIT = 100
+
+_full_scan = re.compile(r'^SCAN (\w+)$')
+_request: ContextVar[Optional[dict]] = ContextVar('plan_guard_request', default=None)
+
+
+class HotEndpoint(NamedTuple):
+    queries: int  # statements one request may run, auth included
+    scans: tuple[str, ...] = ()  # tables the endpoint reads in full on purpose
+    per_line: int = 0  # extra statements per order line
+    per_include: int = 0  # extra statements per embedded relation, e.g. ?include=holders
+
+    def budget(self, lines: int = 0, includes: int = 0) -> int:
+        return self.queries + self.per_line * lines + self.per_include * includes
+
+
+# Budgets are what the endpoints run today. A change that needs more queries or
+# scans another table has to update this registry, and so gets noticed in review.
+HOT_ENDPOINTS = {
+    # api key check, expired session cleanup, session lookup
+    'GET /api/v1/users/me': HotEndpoint(3),
+    # the listing is the whole catalogue
+    'GET /api/v1/pens': HotEndpoint(1, scans=('pen',), per_include=1),
+    # admins list every transaction
+    'GET /api/v1/transactions': HotEndpoint(5, scans=('transaction', 'archivedtransaction')),
+    'POST /api/v1/transactions/quote': HotEndpoint(3, scans=('pen',)),
+    'POST /api/v1/transactions/request': HotEndpoint(6),
+    # stock, credit and sales counter per line, the counters insert on a first sale
+    'POST /api/v1/transactions/{transaction_id}/complete': HotEndpoint(12, per_line=4),
+}
+
+
+def full_scans(plan: list[str]) -> set[str]:
+    # "SCAN pen" reads every row, "SCAN pen USING INDEX ..." only walks an index
+    return {match.group(1) for step in plan if (match := _full_scan.match(step.strip()))}
+
+
+class PlanGuard:
+    def __init__(self, endpoints: dict[str, HotEndpoint] = HOT_ENDPOINTS):
+        self.endpoints = endpoints
+        self.violations: deque[dict] = deque(maxlen=VIOLATIONS_LIMIT)
+        self._checked: set[tuple[str, str]] = set()
+        self.last: dict[str, int] = {}  # statements of the latest request per endpoint
+
+    def needs_plan(self, endpoint: Optional[str], sql: str) -> bool:
+        return endpoint in self.endpoints and (endpoint, sql) not in self._checked
+
+    def check_plan(self, endpoint: str, sql: str, plan: Optional[list[str]]) -> None:
+        self._checked.add((endpoint, sql))
+        scanned = full_scans(plan or []) - set(self.endpoints[endpoint].scans)
+        if scanned:
+            self._violation(endpoint, f"full scan of {', '.join(sorted(scanned))}", sql)
+
+    def track(self) -> dict:
+        # per request facts the handlers report back, read by check_count when the request ends
+        request = {}
+        _request.set(request)
+        return request
+
+    def note_lines(self, lines: int) -> None:
+        request = _request.get()
+        if request is not None:
+            request['lines'] = lines
+
+    def note_include(self) -> None:
+        request = _request.get()
+        if request is not None:
+            request['includes'] = request.get('includes', 0) + 1
+
+    def check_count(self, endpoint: Optional[str], statements: int,
+                    lines: Optional[int] = None, includes: int = 0) -> None:
+        # per line budgets are skipped when the handler failed before it knew the order size
+        hot = self.endpoints.get(endpoint)
+        if hot is None:
+            return
+        self.last[endpoint] = statements
+        if hot.per_line and lines is None:
+            return
+        budget = hot.budget(lines or 0, includes)
+        if statements > budget:
+            self._violation(endpoint, f"{statements} queries, expected at most {budget}")
+
+    def _violation(self, endpoint: str, problem: str, sql: Optional[str] = None) -> None:
+        metrics.inc("db.plan_guard.violations")
+        logger.error("Query plan regression in %s: %s %s", endpoint, problem, sql or '')
+        self.violations.append({"timestamp": time.time(),
+                                "endpoint": endpoint,
+                                "problem": problem,
+                                "sql": sql})
+
+    def clear(self) -> None:
+        self.violations.clear()
+        self._checked.clear()
+        self.last.clear()
+
+
+plan_guard = PlanGuard()
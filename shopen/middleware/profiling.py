@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+from shopen.middleware import metrics
+from shopen.settings import (LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD,
+                             PROFILE_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+BLOCKED_LIMIT = 32
+
+
+def collapse(frame) -> str:
+    # root first, the way flamegraph.pl and speedscope expect collapsed stacks
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def thread_stack(thread_id: int) -> Optional[str]:
+    frame = sys._current_frames().get(thread_id)
+    return collapse(frame) if frame is not None else None
+
+
+def lag_bucket(lag: float) -> str:
+    for bound in LAG_BUCKETS:
+        if lag <= bound:
+            return f"le_{bound}"
+    return "le_inf"
+
+
+class LoopMonitor:
+    # The loop side measures how late its own sleep wakes up. The watchdog thread
+    # notices a heartbeat that stopped moving and grabs the loop thread's stack
+    # while the blocking callback is still running.
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL,
+                 threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked: deque[dict] = deque(maxlen=BLOCKED_LIMIT)
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def record_lag(self, lag: float) -> None:
+        metrics.observe("event_loop.lag_seconds", lag)
+        metrics.inc(f"event_loop.lag.{lag_bucket(lag)}")
+
+    async def _measure(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.record_lag(max(0.0, now - expected))
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < self.threshold or heartbeat == reported:
+                continue
+            # one report per stall, taken while the loop is still stuck
+            reported = heartbeat
+            stack = thread_stack(self._loop_thread)
+            if stack is None:
+                continue
+            metrics.inc("event_loop.blocked")
+            self.blocked.append({"timestamp": time.time(),
+                                 "stalledSeconds": round(stalled, 3),
+                                 "stack": stack})
+            logger.warning("Event loop blocked for %.3fs in %s", stalled, stack)
+
+    def start(self) -> None:
+        if self._task is not None or self.interval <= 0:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure(), name="loop_monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._watchdog.join()
+        self._task = None
+        self._watchdog = None
+
+
+loop_monitor = LoopMonitor()
+
+
+def _sample(thread_id: int, duration: float, interval: float) -> Counter:
+    stacks = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        stack = thread_stack(thread_id)
+        if stack is not None:
+            stacks[stack] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def sample_profile(duration: float, interval: float = PROFILE_INTERVAL) -> str:
+    # samples the event loop thread from a worker thread, so the loop keeps serving
+    # while it is being profiled; idle loop time shows up under select/epoll
+    started = time.perf_counter()
+    stacks = await asyncio.to_thread(_sample, threading.get_ident(), duration, interval)
+    metrics.inc("profiler.runs")
+    metrics.observe("profiler.seconds", time.perf_counter() - started)
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,62 @@
+from collections import defaultdict
+from typing import Hashable
+from shopen.middleware import metrics
+
+
+class ReservationLedger:
+    # Methods never await, so every check-and-hold is atomic on the event loop
+    def __init__(self):
+        self._held: dict[int, int] = defaultdict(int)
+        self._orders: dict[Hashable, dict[int, int]] = {}
+
+    def held(self, pen_id: int) -> int:
+        return self._held.get(pen_id, 0)
+
+    def available(self, pen_id: int, stock: int) -> int:
+        return stock - self.held(pen_id)
+
+    def reserve(self, key: Hashable, needed: dict[int, int], stock: dict[int, int]) -> bool:
+        for pen_id, number in needed.items():
+            if self.available(pen_id, stock[pen_id]) < number:
+                metrics.inc("reservations.rejected")
+                return False
+        for pen_id, number in needed.items():
+            self._held[pen_id] += number
+        self._orders[key] = dict(needed)
+        metrics.inc("reservations.held")
+        return True
+
+    def rekey(self, old: Hashable, new: Hashable) -> None:
+        self._orders[new] = self._orders.pop(old)
+
+    def _drop(self, key: Hashable) -> bool:
+        order = self._orders.pop(key, None)
+        if order is None:
+            return False
+        for pen_id, number in order.items():
+            self._held[pen_id] -= number
+            if self._held[pen_id] <= 0:
+                del self._held[pen_id]
+        return True
+
+    def release(self, key: Hashable) -> bool:
+        released = self._drop(key)
+        if released:
+            metrics.inc("reservations.released")
+        return released
+
+    def commit(self, key: Hashable) -> bool:
+        committed = self._drop(key)
+        if committed:
+            metrics.inc("reservations.committed")
+        return committed
+
+    def clear(self) -> None:
+        self._held.clear()
+        self._orders.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._orders
+
+
+reservations = ReservationLedger()
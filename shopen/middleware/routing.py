@@ -0,0 +1,43 @@
+import itertools
+from contextvars import ContextVar
+from typing import Optional
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from shopen.models.models import Pen
+from shopen.settings import DB_READ_CONNECTIONS
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# set for requests that may write, their reads stay on the primary to see their own writes
+_primary_only: ContextVar[bool] = ContextVar('primary_only', default=False)
+_round_robin = itertools.count()
+
+
+def use_primary() -> None:
+    _primary_only.set(True)
+
+
+def read_db() -> Optional[BaseDBAsyncClient]:
+    # None means the model's own connection, i.e. the primary or the current transaction
+    if not DB_READ_CONNECTIONS or _primary_only.get():
+        return None
+    name = DB_READ_CONNECTIONS[next(_round_robin) % len(DB_READ_CONNECTIONS)]
+    if name not in connections.db_config:
+        return None
+    return connections.get(name)
+
+
+def in_primary_transaction():
+    # read connections make the connection name ambiguous, so transactions name the primary
+    return in_transaction(Pen._meta.default_connection)
+
+
+class ReadRouting:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] not in SAFE_METHODS:
+            use_primary()
+        await self.app(scope, receive, send)
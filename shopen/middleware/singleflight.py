@@ -0,0 +1,37 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+from shopen.middleware import metrics
+
+
+class SingleFlight:
+    # concurrent calls with the same key share one in-flight execution and its result
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.shared = 0
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller went away
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            metrics.inc(f"{self.name}.executed")
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+            metrics.inc(f"{self.name}.shared")
+        metrics.set_gauge(f"{self.name}.coalescing_ratio",
+                          self.shared / (self.shared + self.executed))
+        # a cancelled caller must not cancel the call other callers wait for
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._calls)
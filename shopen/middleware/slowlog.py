@@ -0,0 +1,170 @@
+import functools
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from shopen.middleware import metrics
+from shopen.middleware.plans import plan_guard
+from shopen.settings import (SLOW_QUERY_LOG, SLOW_QUERY_THRESHOLD,
+                             SLOW_QUERY_EXPLAIN, SLOW_QUERY_TOP, PLAN_GUARD)
+
+logger = logging.getLogger(__name__)
+
+EXECUTE_METHODS = ('execute_query', 'execute_query_dict', 'execute_insert', 'execute_many')
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+PARAMS_LIMIT = 200
+STATEMENTS_LIMIT = 1000
+
+_scope: ContextVar[Optional[dict]] = ContextVar('slow_query_scope', default=None)
+_statements: ContextVar[Optional[list[str]]] = ContextVar('request_statements', default=None)
+_placeholders = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def normalise(sql: str) -> str:
+    # id__in lists of any length share one entry
+    return _placeholders.sub('?, ...', ' '.join(sql.split()))
+
+
+def endpoint() -> Optional[str]:
+    scope = _scope.get()
+    if scope is None:
+        return None
+    path = scope['path']
+    route = getattr(scope.get('route'), 'path', None)
+    if route is not None:
+        # included routers keep their path relative to the prefix, put the prefix back
+        concrete = route.format(**scope.get('path_params', {}))
+        if path.endswith(concrete):
+            path = path[:len(path) - len(concrete)] + route
+    return f"{scope['method']} {path}"
+
+
+async def explain(client: BaseDBAsyncClient, sql: str, values) -> Optional[list[str]]:
+    if client.capabilities.dialect != 'sqlite' or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    if isinstance(values, list) and values and isinstance(values[0], (list, tuple)):
+        values = values[0]
+    try:
+        rows = await _original(type(client), 'execute_query_dict')(client, f"EXPLAIN QUERY PLAN {sql}", values)
+    except Exception:
+        logger.exception("Could not explain query")
+        return None
+    return [row['detail'] for row in rows]
+
+
+class SlowQueryLog:
+    def __init__(self, threshold: float = SLOW_QUERY_THRESHOLD,
+                 explain: bool = SLOW_QUERY_EXPLAIN):
+        self.threshold = threshold
+        self.explain = explain
+        self._statements: dict[str, dict] = {}
+
+    async def record(self, client: BaseDBAsyncClient, sql: str, values, seconds: float) -> None:
+        metrics.inc("db.slow_queries")
+        key = normalise(sql)
+        entry = self._statements.get(key)
+        if entry is None:
+            if len(self._statements) >= STATEMENTS_LIMIT:
+                return
+            # one plan per statement shape is enough, the schema does not change at runtime
+            entry = self._statements[key] = {
+                "sql": key, "count": 0, "totalSeconds": 0.0, "maxSeconds": 0.0,
+                "lastParams": None, "endpoints": {},
+                "plan": await explain(client, sql, values) if self.explain else None}
+        params = repr(values)[:PARAMS_LIMIT]
+        source = endpoint()
+        entry["count"] += 1
+        entry["totalSeconds"] += seconds
+        entry["maxSeconds"] = max(entry["maxSeconds"], seconds)
+        entry["lastParams"] = params
+        entry["endpoints"][source] = entry["endpoints"].get(source, 0) + 1
+        logger.warning("Slow query %.3fs from %s: %s %s plan=%s",
+                       seconds, source, key, params, entry["plan"])
+
+    def top(self, limit: int = SLOW_QUERY_TOP) -> list[dict]:
+        ordered = sorted(self._statements.values(), key=lambda e: e["totalSeconds"], reverse=True)
+        return [{**entry, "endpoints": [{"endpoint": name, "count": count}
+                                        for name, count in entry["endpoints"].items()]}
+                for entry in ordered[:limit]]
+
+    def clear(self) -> None:
+        self._statements.clear()
+
+
+slow_queries = SlowQueryLog()
+
+
+def _timed(method):
+    @functools.wraps(method)
+    async def wrapper(self, query, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(self, query, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            values = args[0] if args else kwargs.get('values')
+            if SLOW_QUERY_LOG and seconds >= slow_queries.threshold:
+                await slow_queries.record(self, query, values, seconds)
+            if PLAN_GUARD:
+                await _guard(self, query, values)
+    wrapper.__slow_query_original__ = method
+    return wrapper
+
+
+async def _guard(client: BaseDBAsyncClient, sql: str, values) -> None:
+    statements = _statements.get()
+    if statements is None:
+        return
+    statements.append(sql)
+    source = endpoint()
+    shape = normalise(sql)
+    if plan_guard.needs_plan(source, shape):
+        plan_guard.check_plan(source, shape, await explain(client, sql, values))
+
+
+def _original(cls: type, name: str):
+    method = getattr(cls, name)
+    return getattr(method, '__slow_query_original__', method)
+
+
+def install(client_class: type[BaseDBAsyncClient]) -> None:
+    # wraps the executor methods of a backend client and its transaction subclasses
+    if not SLOW_QUERY_LOG and not PLAN_GUARD:
+        return
+    pending = [client_class]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        for name in EXECUTE_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not hasattr(method, '__slow_query_original__'):
+                setattr(cls, name, _timed(method))
+
+
+def install_connections() -> None:
+    for connection in connections.all():
+        # the outermost backend class that implements the executors, e.g. SqliteClient
+        backend = [cls for cls in type(connection).__mro__ if cls is not BaseDBAsyncClient
+                   and any(name in cls.__dict__ for name in EXECUTE_METHODS)][-1]
+        install(backend)
+
+
+class QueryContext:
+    # remembers the request scope so slow queries can name the endpoint that ran them,
+    # and counts the statements of the request for the plan guard
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        _scope.set(scope)
+        statements = []
+        _statements.set(statements)
+        request = plan_guard.track()
+        await self.app(scope, receive, send)
+        if PLAN_GUARD:
+            plan_guard.check_count(endpoint(), len(statements), request.get('lines'), request.get('includes', 0))
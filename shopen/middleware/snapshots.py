@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import time
+import aiosqlite
+from tortoise import Tortoise, connections
+from shopen.middleware import metrics
+from shopen.models.models import Pen
+from shopen.settings import DB_SNAPSHOT_PATH
+
+# The backup API needs the raw aiosqlite connection of the tortoise client. Holding the
+# client's lock keeps queries and transactions out while pages are copied, so a snapshot
+# is always a committed state.
+
+
+def _client():
+    return connections.get(Pen._meta.default_connection)
+
+
+async def save_snapshot(path: str = DB_SNAPSHOT_PATH) -> None:
+    started = time.perf_counter()
+    client = _client()
+    await client.create_connection(with_db=True)
+    partial = f"{path}.partial"
+    target = sqlite3.connect(partial, check_same_thread=False)
+    try:
+        # durability comes from the rename below, not from the journal
+        target.execute('PRAGMA journal_mode=OFF')
+        target.execute('PRAGMA synchronous=OFF')
+        async with client._lock:
+            await client._connection.backup(target)
+    finally:
+        target.close()
+    os.replace(partial, path)
+    metrics.inc("db.snapshot.saved")
+    metrics.observe("db.snapshot.seconds", time.perf_counter() - started)
+
+
+async def restore_snapshot(path: str = DB_SNAPSHOT_PATH) -> bool:
+    if not os.path.exists(path):
+        return False
+    client = _client()
+    await client.create_connection(with_db=True)
+    source = await aiosqlite.connect(path)
+    try:
+        async with client._lock:
+            await source.backup(client._connection)
+    finally:
+        await source.close()
+    # tables and indexes added since the snapshot was taken
+    await Tortoise.generate_schemas(safe=True)
+    metrics.inc("db.snapshot.restored")
+    return True
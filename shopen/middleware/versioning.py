@@ -0,0 +1,46 @@
+import asyncio
+import random
+from typing import Awaitable, Callable, TypeVar
+from fastapi import HTTPException
+from tortoise.expressions import F
+from tortoise.models import Model
+from shopen.middleware import metrics
+from shopen.settings import VERSION_RETRY_ATTEMPTS, VERSION_RETRY_BACKOFF
+
+T = TypeVar('T')
+
+
+class StaleVersion(Exception):
+    pass
+
+
+async def swap(instance: Model, **changes) -> None:
+    # compare-and-swap against the version the instance was read with
+    model = type(instance)
+    updated = await model.filter(pk=instance.pk, version=instance.version) \
+        .update(version=F('version') + 1, **changes)
+    if not updated:
+        metrics.inc(f"versioning.{model.__name__.lower()}.conflicts")
+        raise StaleVersion(f"{model.__name__} {instance.pk} changed since version {instance.version}")
+    for name, value in changes.items():
+        setattr(instance, name, value)
+    instance.version += 1
+
+
+async def retry_stale(operation: Callable[[], Awaitable[T]], *instances: Model,
+                      attempts: int = VERSION_RETRY_ATTEMPTS) -> T:
+    # operation re-reads whatever it needs, instances passed here are refreshed for it
+    for attempt in range(1, attempts + 1):
+        try:
+            return await operation()
+        except StaleVersion:
+            metrics.inc("versioning.retries")
+            if attempt == attempts:
+                break
+            await asyncio.sleep(random.uniform(0, VERSION_RETRY_BACKOFF * attempt))
+            for instance in instances:
+                await instance.refresh_from_db()
+    metrics.inc("versioning.exhausted")
+    raise HTTPException(
+        status_code=409,
+        detail="Resource was modified concurrently, please retry")
@@ -12,6 +12,17 @@ class Pen(Model):
     color = fields.TextField(null=True)
     length = fields.IntField(null=True)
     is_deleted = fields.BooleanField(default=False)
+    version = fields.IntField(default=0)  # bumped by every write, see middleware.versioning
+
+
+class Holder(Model):
+    id = fields.IntField(primary_key=True, generated=True)
+    pen = fields.ForeignKeyField('models.Pen',
+                                 related_name='holders',
+                                 on_delete=fields.CASCADE,
+                                 db_index=True)
+    name = fields.TextField()
+    capacity = fields.IntField()
 
 
 class User(Model):
@@ -21,23 +32,122 @@ class User(Model):
     password = fields.TextField()
     credit = fields.FloatField(default=0)
     is_superuser = fields.BooleanField(default=False)
+    version = fields.IntField(default=0)
+
+    class Meta:
+        # role filter plus name prefix range, already in name order for paging
+        indexes = (("role", "name"),)
 
 
 class Transaction(Model):
     id = fields.IntField(primary_key=True, generated=True)
     user = fields.ForeignKeyField('models.User',
                                         related_name='transactions',
-                                        on_delete=fields.CASCADE)
+                                        on_delete=fields.CASCADE,
+                                        db_index=True)
     price = fields.FloatField()
     timestamp = fields.DatetimeField(auto_now_add=True)
-    order = fields.JSONField()  # list of pen ids + number
+    order = fields.JSONField()  # list of pen ids + number, kept in API shape; lines are the source of truth
     status = fields.TextField(default='requested')  # requested, completed, cancelled, refunded
 
+    class Meta:
+        indexes = (("status", "timestamp"),)
+
+
+class ArchivedTransaction(Model):
+    # finished transactions past the refund window, partitioned by month
+    id = fields.IntField(primary_key=True, generated=False)
+    user = fields.ForeignKeyField('models.User',
+                                  related_name='archived_transactions',
+                                  on_delete=fields.CASCADE,
+                                  db_index=True)
+    price = fields.FloatField()
+    timestamp = fields.DatetimeField()
+    order = fields.JSONField()
+    status = fields.TextField()
+    month = fields.CharField(max_length=7, db_index=True)  # YYYY-MM
+
+
+class TransactionLine(Model):
+    id = fields.IntField(primary_key=True, generated=True)
+    transaction = fields.ForeignKeyField('models.Transaction',
+                                         related_name='lines',
+                                         on_delete=fields.CASCADE,
+                                         db_index=True)
+    pen_id = fields.IntField(db_index=True)
+    number = fields.IntField()
+
+
+class ArchivedTransactionLine(Model):
+    # lines move to the archive with their transaction
+    id = fields.IntField(primary_key=True, generated=True)
+    transaction = fields.ForeignKeyField('models.ArchivedTransaction',
+                                         related_name='lines',
+                                         on_delete=fields.CASCADE,
+                                         db_index=True)
+    pen_id = fields.IntField(db_index=True)
+    number = fields.IntField()
+
 
 class Session(Model):
     id = fields.IntField(primary_key=True, generated=True)
     user = fields.ForeignKeyField('models.User',
                                   related_name='sessions',
-                                  on_delete=fields.CASCADE)
-    token = fields.TextField()
-    expiry = fields.DatetimeField()
+                                  on_delete=fields.CASCADE,
+                                  db_index=True)
+    token = fields.CharField(max_length=64, db_index=True)  # looked up on every authenticated request
+    expiry = fields.DatetimeField(db_index=True)
+
+
+class LedgerEntry(Model):
+    # append-only, plain ids keep history independent of deletes
+    id = fields.IntField(primary_key=True, generated=True)
+    kind = fields.CharField(max_length=20)  # purchase, refund, restock, initial, removal, credit
+    user_id = fields.IntField(null=True, db_index=True)
+    pen_id = fields.IntField(null=True, db_index=True)
+    transaction_id = fields.IntField(null=True, db_index=True)
+    credit = fields.FloatField(default=0)  # credit delta of the user
+    stock = fields.IntField(default=0)  # stock delta of the pen
+    timestamp = fields.DatetimeField(auto_now_add=True)
+
+
+class UserSpend(Model):
+    user_id = fields.IntField(primary_key=True)
+    spent = fields.FloatField(default=0)
+    transactions = fields.IntField(default=0)
+
+
+class PenSales(Model):
+    pen_id = fields.IntField(primary_key=True)
+    units = fields.IntField(default=0)
+
+
+class DailyRevenue(Model):
+    day = fields.DateField(primary_key=True)
+    revenue = fields.FloatField(default=0)
+    transactions = fields.IntField(default=0)
+
+
+class OutboxEvent(Model):
+    # written in the same db transaction as the change it describes
+    id = fields.IntField(primary_key=True, generated=True)
+    kind = fields.CharField(max_length=40)  # transaction.completed, transaction.refunded, pen.restocked, pen.deleted
+    payload = fields.JSONField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+    delivered = fields.BooleanField(default=False)
+    attempts = fields.IntField(default=0)
+    next_attempt_at = fields.DatetimeField(null=True)
+    last_error = fields.TextField(null=True)
+
+    class Meta:
+        indexes = (("delivered", "next_attempt_at"),)
+
+
+class AuditRecord(Model):
+    # plain ids, the trail outlives the users and pens it mentions
+    id = fields.IntField(primary_key=True, generated=True)
+    action = fields.CharField(max_length=40, db_index=True)
+    actor_id = fields.IntField(null=True, db_index=True)
+    subject = fields.CharField(max_length=60, null=True)  # pen:<id>, user:<id>, transaction:<id>
+    details = fields.JSONField(null=True)
+    timestamp = fields.DatetimeField()  # when it happened, not when the batch was written
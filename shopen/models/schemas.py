@@ -1,6 +1,7 @@
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import (BaseModel, field_validator as validator,
-                      ValidationError, conint)
+                      ValidationError, conint, confloat)
+from shopen.settings import MAX_ORDER_LINES, MAX_BULK_CREDIT_USERS
 
 
 class UserCredentials(BaseModel):
@@ -18,6 +19,22 @@ class UserCredit(BaseModel):
         return value
 
 
+class BulkCredit(BaseModel):
+    operation: Literal['set', 'increment']
+    amount: confloat(ge=0)
+    users: list[int]
+
+    @validator('users', mode='before')
+    def validate_users_size(cls, value):
+        if isinstance(value, list) and len(value) > MAX_BULK_CREDIT_USERS:
+            raise ValueError(f"Can not change credit of more than {MAX_BULK_CREDIT_USERS} users at once")
+        return value
+
+    @validator('users')
+    def unique_users(cls, value):
+        return list(dict.fromkeys(value))
+
+
 class NewPen(BaseModel):
     brand: str
     price: float
@@ -53,6 +70,22 @@ class PenRequest(BaseModel):
 class TransactionRequest(BaseModel):
     order: list[PenRequest]
 
+    @validator('order', mode='before')
+    def validate_order_size(cls, value):
+        # checked on the raw list, before any line is parsed
+        if isinstance(value, list) and len(value) > MAX_ORDER_LINES:
+            raise ValueError(f"Order can not have more than {MAX_ORDER_LINES} lines")
+        return value
+
+    @validator('order')
+    def merge_order_lines(cls, value):
+        merged: dict[int, int] = {}
+        for line in value:
+            merged[line.id] = merged.get(line.id, 0) + line.count
+        if len(merged) == len(value):
+            return value
+        return [PenRequest(id=pen_id, count=count) for pen_id, count in merged.items()]
+
 
 class TransactionStatus(BaseModel):
     status: str
@@ -1,9 +1,22 @@
-from shopen.models.models import User, Session, Transaction, Pen
+from tortoise.expressions import Subquery
+from tortoise.transactions import in_transaction
+from shopen.models.models import (User, Session, Transaction, TransactionLine,
+                                   ArchivedTransaction, ArchivedTransactionLine, Pen, Holder,
+                                   LedgerEntry, UserSpend, PenSales, DailyRevenue, OutboxEvent)
 
 
 async def setup_reset():
+    await OutboxEvent.all().delete()
+    await LedgerEntry.all().delete()
+    await UserSpend.all().delete()
+    await PenSales.all().delete()
+    await DailyRevenue.all().delete()
     await Session.all().delete()
+    await TransactionLine.all().delete()
     await Transaction.all().delete()
+    await ArchivedTransactionLine.all().delete()
+    await ArchivedTransaction.all().delete()
+    await Holder.all().delete()
     await User.all().delete()
     await Pen.all().delete()
 
@@ -15,16 +28,82 @@ async def set_default_users() -> User:
                              is_superuser=True)
 
 
-async def set_default_stock():
-    await Pen.create(brand='Pilot', price=15, stock=100, color='blue', length=15)
-    await Pen.create(brand='Pilot', price=16, stock=100, color='red', length=13)
-    await Pen.create(brand='Pilot', price=15, stock=100, color='black', length=20)
-    await Pen.create(brand='Parker', price=125, stock=50, color='green', length=17)
-    await Pen.create(brand='Parker', price=25, stock=60, color='red', length=17)
-    await Pen.create(brand='Bic', price=3, stock=300, color='blue', length=19)
+async def set_default_stock() -> list[Pen]:
+    pens = [
+        await Pen.create(brand='Pilot', price=15, stock=100, color='blue', length=15),
+        await Pen.create(brand='Pilot', price=16, stock=100, color='red', length=13),
+        await Pen.create(brand='Pilot', price=15, stock=100, color='black', length=20),
+        await Pen.create(brand='Parker', price=125, stock=50, color='green', length=17),
+        await Pen.create(brand='Parker', price=25, stock=60, color='red', length=17),
+        await Pen.create(brand='Bic', price=3, stock=300, color='blue', length=19),
+    ]
+    await LedgerEntry.bulk_create([LedgerEntry(kind='initial', pen_id=pen.id, stock=pen.stock) for pen in pens])
+    return pens
+
+
+async def set_default_holders(pens: list[Pen]) -> None:
+    await Holder.create(pen=pens[0], name='holderMax', capacity=10)
+    await Holder.create(pen=pens[0], name='Thule', capacity=25)
+    await Holder.create(pen=pens[2], name='HELLo', capacity=666)
+
+
+async def migrate_holders() -> None:
+    # holders used to be a fixed list for pens 1 and 3, older databases get that list as rows
+    if await Holder.exists():
+        return
+    pens = await Pen.filter(id__lte=3).order_by('id')
+    if len(pens) == 3:
+        await set_default_holders(pens)
 
 
 async def is_db_empty() -> bool:
     users = await User.all().count() == 0
     pens = await Pen.all().count() == 0
     return users and pens
+
+
+# PRAGMA user_version counts the one-off data migrations a database has been through
+LINES_MIGRATED = 1
+
+
+async def data_version() -> int:
+    rows = await Transaction._meta.db.execute_query_dict('PRAGMA user_version')
+    return rows[0]['user_version']
+
+
+async def set_data_version(version: int) -> None:
+    await Transaction._meta.db.execute_script(f'PRAGMA user_version = {int(version)}')
+
+
+async def migrate_transaction_lines(batch_size: int = 1000) -> int:
+    # backfill lines of transactions created before TransactionLine existed, once per database;
+    # transactions with an empty or malformed order never get a line and are not looked at again
+    if await data_version() >= LINES_MIGRATED:
+        return 0
+    migrated = 0
+    last_id = 0
+    while True:
+        batch = await Transaction.filter(id__gt=last_id) \
+            .exclude(id__in=Subquery(TransactionLine.all().values('transaction_id'))) \
+            .order_by('id').limit(batch_size).values('id', 'order')
+        if not batch:
+            await set_data_version(LINES_MIGRATED)
+            return migrated
+        lines = [TransactionLine(transaction_id=row['id'], pen_id=item['penId'], number=item['number'])
+                 for row in batch
+                 for item in row['order'] or []
+                 if isinstance(item, dict) and 'penId' in item and 'number' in item]
+        async with in_transaction(TransactionLine._meta.default_connection):
+            await TransactionLine.bulk_create(lines)
+        migrated += len(batch)
+        last_id = batch[-1]['id']
+
+
+async def migrate_version_columns() -> None:
+    # generate_schemas only creates missing tables, older databases get the column here
+    for model in (Pen, User):
+        table = model._meta.db_table
+        columns = await model._meta.db.execute_query_dict(f'PRAGMA table_info("{table}")')
+        if 'version' not in {column['name'] for column in columns}:
+            await model._meta.db.execute_script(
+                f'ALTER TABLE "{table}" ADD COLUMN "version" INT NOT NULL DEFAULT 0')
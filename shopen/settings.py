@@ -5,14 +5,34 @@ if os.getenv('ENV') == 'LOCAL':
 
     load_dotenv()
 
+
+def _per_route_class(name: str, default: str) -> dict[str, float]:
+    # "auth=16,catalogue=64" -> {"auth": 16, "catalogue": 64}
+    pairs = (item.split('=') for item in os.getenv(name, default=default).split(',') if item)
+    return {key.strip(): float(value) for key, value in pairs}
+
+
 VERSION = "1.0.0"
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_ROOT = os.path.join(BASE_DIR, 'shopen/assets')
 
+# sandbox mode: the database lives in memory and is only snapshotted to DB_SNAPSHOT_PATH,
+# restored on startup, every DB_SNAPSHOT_SECONDS and on shutdown
+DB_MEMORY = os.getenv('DB_MEMORY', default='false').lower() == 'true'
+DB_SNAPSHOT_PATH = os.getenv('DB_SNAPSHOT_PATH', default='db.snapshot.sqlite3')
+DB_SNAPSHOT_INTERVAL = int(os.getenv('DB_SNAPSHOT_SECONDS', default=60))
+
+DB_URL = 'sqlite://:memory:' if DB_MEMORY else os.getenv('DB_URL', default='sqlite://db.sqlite3')
+# extra read-only connections to the same sqlite file, WAL lets them read while the primary writes;
+# every :memory: connection is a database of its own, so memory mode has none
+DB_READ_CONNECTIONS = [] if DB_MEMORY else \
+    [f'read_{i}' for i in range(int(os.getenv('DB_READ_CONNECTIONS', default=2)))]
+
 DB_CONFIG = {
     "connections": {
-        "default": "sqlite://db.sqlite3",
+        "default": DB_URL,
+        **{name: f"{DB_URL}?query_only=1" for name in DB_READ_CONNECTIONS},
     },
     "apps": {
         "models": {
@@ -28,3 +48,54 @@ WHOLESALE_DISCOUNT = float(os.getenv('WHOLESALE_DISCOUNT', default=0.1))
 WHOLESALE_THRESHOLD = int(os.getenv('WHOLESALE_THRESHOLD', default=5_000))
 TRANSACTION_REQUEST_THRESHOLD = int(os.getenv('TRANSACTION_REQUEST_MINUTES', default=5))
 TRANSACTION_REFUND_THRESHOLD = int(os.getenv('TRANSACTION_REFUND_MINUTES', default=20))
+TRANSACTION_EXPIRY_INTERVAL = int(os.getenv('TRANSACTION_EXPIRY_SECONDS', default=60))
+TRANSACTION_EXPIRY_BATCH = int(os.getenv('TRANSACTION_EXPIRY_BATCH', default=500))
+STOCK_RESERVATION = os.getenv('STOCK_RESERVATION', default='false').lower() == 'true'
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', default=10_000))
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', default=24 * 60 * 60))
+STOCK_FEED_COALESCE = int(os.getenv('STOCK_FEED_COALESCE_MS', default=250)) / 1000
+STOCK_FEED_KEEPALIVE = int(os.getenv('STOCK_FEED_KEEPALIVE_SECONDS', default=15))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', default=1000))
+ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL_SECONDS', default=60 * 60))
+ARCHIVE_BATCH = int(os.getenv('ARCHIVE_BATCH', default=1000))
+TRANSACTION_BATCH_WINDOW = float(os.getenv('TRANSACTION_BATCH_WINDOW_MS', default=0)) / 1000
+TRANSACTION_BATCH_MAX_ROWS = int(os.getenv('TRANSACTION_BATCH_MAX_ROWS', default=64))
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', default='true').lower() == 'true'
+ADMISSION_LIMITS = {key: int(value) for key, value in _per_route_class(
+    'ADMISSION_LIMITS', 'auth=16,catalogue=64,checkout=8,admin=4,other=32').items()}
+ADMISSION_QUEUES = {key: int(value) for key, value in _per_route_class(
+    'ADMISSION_QUEUES', 'auth=64,catalogue=256,checkout=32,admin=16,other=64').items()}
+ADMISSION_TIMEOUTS = {key: value / 1000 for key, value in _per_route_class(
+    'ADMISSION_TIMEOUTS_MS', 'auth=1000,catalogue=500,checkout=2000,admin=5000,other=1000').items()}
+PEN_SNAPSHOT_TTL = float(os.getenv('PEN_SNAPSHOT_TTL_SECONDS', default=5))
+MAX_BODY_BYTES = int(os.getenv('MAX_BODY_BYTES', default=64 * 1024))
+MAX_ORDER_LINES = int(os.getenv('MAX_ORDER_LINES', default=100))
+HOLDERS_PAGE_LIMIT = int(os.getenv('HOLDERS_PAGE_LIMIT', default=100))
+LOOP_MONITOR_INTERVAL = int(os.getenv('LOOP_MONITOR_INTERVAL_MS', default=100)) / 1000
+LOOP_BLOCK_THRESHOLD = int(os.getenv('LOOP_BLOCK_THRESHOLD_MS', default=250)) / 1000
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', default=30))
+PROFILE_INTERVAL = int(os.getenv('PROFILE_INTERVAL_MS', default=5)) / 1000
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', default='true').lower() == 'true'
+SLOW_QUERY_THRESHOLD = int(os.getenv('SLOW_QUERY_MS', default=100)) / 1000
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', default='true').lower() == 'true'
+SLOW_QUERY_TOP = int(os.getenv('SLOW_QUERY_TOP', default=20))
+VERSION_RETRY_ATTEMPTS = int(os.getenv('VERSION_RETRY_ATTEMPTS', default=5))
+VERSION_RETRY_BACKOFF = int(os.getenv('VERSION_RETRY_BACKOFF_MS', default=5)) / 1000
+OUTBOX_SINK = os.getenv('OUTBOX_SINK', default='')  # file:<path>, webhook:<url> or queue, empty disables the outbox
+OUTBOX_INTERVAL = float(os.getenv('OUTBOX_INTERVAL_SECONDS', default=1))
+OUTBOX_BATCH = int(os.getenv('OUTBOX_BATCH', default=100))
+OUTBOX_BACKOFF = float(os.getenv('OUTBOX_BACKOFF_SECONDS', default=1))
+OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX_SECONDS', default=300))
+OUTBOX_WEBHOOK_TIMEOUT = float(os.getenv('OUTBOX_WEBHOOK_TIMEOUT_SECONDS', default=5))
+OUTBOX_RETENTION = int(os.getenv('OUTBOX_RETENTION_HOURS', default=24))
+USERS_PAGE_LIMIT = int(os.getenv('USERS_PAGE_LIMIT', default=100))
+BULK_CREDIT_CHUNK = int(os.getenv('BULK_CREDIT_CHUNK', default=500))
+MAX_BULK_CREDIT_USERS = int(os.getenv('MAX_BULK_CREDIT_USERS', default=10_000))
+# routes whose bodies are allowed past MAX_BODY_BYTES; a bulk credit id takes at most
+# 10 digits and a ", " separator, plus room for the other fields
+BODY_LIMITS = {'/api/v1/users/credit': max(MAX_BODY_BYTES, MAX_BULK_CREDIT_USERS * 12 + 1024)}
+AUDIT_BATCH = int(os.getenv('AUDIT_BATCH', default=200))
+AUDIT_FLUSH_INTERVAL = int(os.getenv('AUDIT_FLUSH_MS', default=1000)) / 1000
+AUDIT_BUFFER = int(os.getenv('AUDIT_BUFFER', default=50_000))
+AUDIT_PAGE_LIMIT = int(os.getenv('AUDIT_PAGE_LIMIT', default=100))
+PLAN_GUARD = os.getenv('PLAN_GUARD', default='true').lower() == 'true'
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestBenchmarksGenerate(TestCase):
+    # a small run in its own process, the generator initialises tortoise itself
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'generated.sqlite3')
+        subprocess.run([sys.executable, '-m', 'benchmarks.generate', '--db', self.path, '--users', '50',
+                        '--pens', '20', '--transactions', '500', '--sessions', '10'],
+                       cwd=ROOT, check=True, capture_output=True)
+        self.db = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def value(self, sql: str):
+        return self.db.execute(sql).fetchone()[0]
+
+    def test_aggregates_match_completed_transactions(self):
+        charged = self.value('SELECT SUM(t.price * (SELECT COUNT(*) FROM transactionline l '
+                             'WHERE l.transaction_id = t.id)) FROM "transaction" t WHERE t.status = "completed"')
+        completed = self.value('SELECT COUNT(*) FROM "transaction" WHERE status = "completed"')
+        units = self.value('SELECT SUM(l.number) FROM transactionline l JOIN "transaction" t '
+                           'ON t.id = l.transaction_id WHERE t.status = "completed"')
+        self.assertAlmostEqual(self.value('SELECT SUM(spent) FROM userspend'), charged, places=2)
+        self.assertAlmostEqual(self.value('SELECT SUM(revenue) FROM dailyrevenue'), charged, places=2)
+        self.assertEqual(self.value('SELECT SUM(transactions) FROM userspend'), completed)
+        self.assertEqual(self.value('SELECT SUM(transactions) FROM dailyrevenue'), completed)
+        self.assertEqual(self.value('SELECT SUM(units) FROM pensales'), units)
+
+    def test_ledger_entries(self):
+        self.assertEqual(self.value('SELECT -SUM(stock) FROM ledgerentry WHERE kind != "initial"'),
+                         self.value('SELECT SUM(units) FROM pensales'))
+        refunded = self.value('SELECT COUNT(*) FROM "transaction" WHERE status = "refunded"')
+        self.assertEqual(self.value('SELECT COUNT(*) FROM ledgerentry WHERE kind = "refund" AND user_id IS NOT NULL'),
+                         refunded)
+        self.assertEqual(self.value('SELECT COUNT(DISTINCT transaction_id) FROM ledgerentry '
+                                    'WHERE kind = "purchase"'),
+                         self.value('SELECT COUNT(*) FROM "transaction" WHERE status IN ("completed", "refunded")'))
+
+    def test_stock_follows_ledger(self):
+        mismatched = self.value('SELECT COUNT(*) FROM pen p WHERE p.stock != '
+                                '(SELECT SUM(stock) FROM ledgerentry l WHERE l.pen_id = p.id)')
+        self.assertEqual(mismatched, 0)
@@ -0,0 +1,39 @@
+import asyncio
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.admission import Limiter, classify
+
+
+class TestMiddlewareAdmission(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    def test_classify(self):
+        self.assertEqual(classify('POST', '/api/v1/users/login'), 'auth')
+        self.assertEqual(classify('GET', '/api/v1/pens'), 'catalogue')
+        self.assertEqual(classify('GET', '/api/v1/pens/3'), 'catalogue')
+        self.assertEqual(classify('DELETE', '/api/v1/pens/3'), 'admin')
+        self.assertEqual(classify('POST', '/api/v1/transactions/7/complete'), 'checkout')
+        self.assertEqual(classify('GET', '/api/v1/transactions/export'), 'admin')
+        self.assertEqual(classify('POST', '/api/v1/transactions/quote'), 'catalogue')
+        self.assertEqual(classify('PATCH', '/api/v1/users/user/4/credit'), 'admin')
+        self.assertEqual(classify('PUT', '/api/v1/users/user/4/promote'), 'admin')
+        self.assertEqual(classify('PUT', '/api/v1/users/user/4/edit'), 'other')
+        self.assertEqual(classify('GET', '/api/v1/users/me'), 'other')
+        self.assertIsNone(classify('GET', '/api/v1/pens/stream'))
+
+    async def test_queue_and_reject(self):
+        limiter = Limiter('test', limit=1, queue_size=1, timeout=0.05)
+        self.assertTrue(await limiter.acquire())
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.waiting, 1)
+        self.assertFalse(await limiter.acquire())
+        limiter.release()
+        self.assertTrue(await queued)
+        self.assertFalse(await limiter.acquire())
+        limiter.release()
+        self.assertEqual((limiter.active, limiter.waiting), (0, 0))
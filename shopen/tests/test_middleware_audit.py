@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+from unittest.mock import patch
+from fastapi import HTTPException
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.audit import AuditLog, audit_log, list_audit_rows
+from shopen.middleware.pens import restock_pen, request_pens, complete_transaction
+from shopen.models.schemas import PenRequest, TransactionRequest
+from shopen.main import app
+from shopen.models.models import AuditRecord, Pen, User, Session
+
+
+class TestMiddlewareAudit(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.admin = await User.create(name='admin', password='admin', role='admin')
+
+    async def test_buffered_until_flush(self):
+        log = AuditLog(batch=10, interval=60)
+        log.record('pen.deleted', self.admin, 'pen:1')
+        self.assertEqual(await AuditRecord.all().count(), 0)
+        self.assertEqual(await log.flush(), 1)
+        record = await AuditRecord.get()
+        self.assertEqual((record.action, record.actor_id, record.subject), ('pen.deleted', self.admin.id, 'pen:1'))
+
+    async def test_flush_on_full_batch(self):
+        log = AuditLog(batch=3, interval=60)
+        log.start()
+        try:
+            for pen_id in range(3):
+                log.record('pen.deleted', self.admin, f'pen:{pen_id}')
+            await asyncio.sleep(0.05)
+            self.assertEqual(await AuditRecord.all().count(), 3)
+            log.record('pen.deleted', self.admin, 'pen:3')
+        finally:
+            await log.stop()
+        # the stop drain writes what is left
+        self.assertEqual(await AuditRecord.all().count(), 4)
+
+    async def test_flush_on_interval(self):
+        log = AuditLog(batch=100, interval=0.01)
+        log.start()
+        try:
+            log.record('factory_reset')
+            await asyncio.sleep(0.05)
+            self.assertEqual(await AuditRecord.all().count(), 1)
+        finally:
+            await log.stop()
+
+    async def test_buffer_limit(self):
+        log = AuditLog(batch=100, interval=60, limit=2)
+        for pen_id in range(3):
+            log.record('pen.deleted', self.admin, f'pen:{pen_id}')
+        self.assertEqual(len(log), 2)
+        await log.flush()
+        self.assertEqual(await AuditRecord.all().order_by('id').values_list('subject', flat=True),
+                         ['pen:1', 'pen:2'])
+
+    async def test_failed_flush_keeps_records(self):
+        log = AuditLog(batch=100, interval=60)
+        log.record('factory_reset')
+        with patch.object(AuditRecord, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                await log.flush()
+        self.assertEqual(len(log), 1)
+        self.assertEqual(await log.flush(), 1)
+
+    async def test_list_audit_rows(self):
+        pen = await Pen.create(brand='space', price=10, stock=10)
+        with patch.object(audit_log, '_pending', audit_log._pending.__class__()):
+            await restock_pen(self.admin, pen.id, 5)
+            audit_log.record('factory_reset')
+            records = await list_audit_rows()
+            self.assertEqual([record['action'] for record in records], ['factory_reset', 'pen.restocked'])
+            self.assertEqual(records[1]['details'], {'units': 5, 'stock': 15})
+            older = await list_audit_rows(before=records[0]['id'])
+            self.assertEqual([record['action'] for record in older], ['pen.restocked'])
+            self.assertEqual(await list_audit_rows(actor_id=self.admin.id, action='factory_reset'), [])
+        with self.assertRaises(HTTPException):
+            await list_audit_rows(limit=0)
+
+    async def test_completed_records_charged(self):
+        user = await User.create(name='test', password='test', credit=1000)
+        pens = [await Pen.create(brand='space', price=10, stock=10) for _ in range(2)]
+        invoice = TransactionRequest(order=[PenRequest(id=pen.id, count=1) for pen in pens])
+        with patch.object(audit_log, '_pending', audit_log._pending.__class__()):
+            transaction = await request_pens(user, invoice)
+            await complete_transaction(user, transaction.id)
+            await user.refresh_from_db()
+            records = await list_audit_rows(action='transaction.completed')
+        self.assertEqual(records[0]['details'], {'charged': 1000 - user.credit})
+
+    async def test_bulk_credit_records_count(self):
+        await Session.create(user=self.admin, token='admin_token', expiry=datetime.now(timezone.utc) + timedelta(days=1))
+        users = [await User.create(name=f'user{i}', password='test') for i in range(3)]
+        with patch.object(audit_log, '_pending', audit_log._pending.__class__()):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test',
+                                         headers={'Authorization': 'admin_token'}) as client:
+                response = await client.post('/api/v1/users/credit', json={
+                    'operation': 'increment', 'amount': 5, 'users': [user.id for user in users]})
+            self.assertEqual(response.status_code, 200)
+            records = await list_audit_rows(action='user.credit.bulk')
+        self.assertEqual(records[0]['details'], {'operation': 'increment', 'amount': 5, 'updated': 3, 'users': 3})
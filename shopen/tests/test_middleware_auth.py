@@ -1,11 +1,13 @@
 from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
 from fastapi import HTTPException
 from tortoise.contrib import test
 from tortoise.contrib.test import initializer, finalizer
 from shopen.models.setup import set_default_users
 from shopen.middleware.auth import User, Session, create_user, \
-    authenticate, list_users, promote_user, get_user, \
-    set_user_credit, get_user_by_token, edit_user
+    authenticate, list_users, list_user_rows, promote_user, get_user, \
+    set_user_credit, get_user_by_token, edit_user, search_user_rows, bulk_set_credit
+from shopen.models.models import LedgerEntry
 
 
 class TestMiddlewareAuth(test.TestCase):
@@ -65,6 +67,13 @@ class TestMiddlewareAuth(test.TestCase):
         with self.assertRaises(HTTPException):
             await list_users(self.user_token)
 
+    async def test_list_user_rows(self):
+        users = await list_users(self.admin_token)
+        self.assertEqual(await list_user_rows(self.admin_token),
+                         [{'id': u.id, 'name': u.name, 'role': u.role, 'credit': u.credit} for u in users])
+        with self.assertRaises(HTTPException):
+            await list_user_rows(self.user_token)
+
     async def test_promote_user(self):
         try:
             await promote_user(self.admin, self.user)
@@ -126,3 +135,32 @@ class TestMiddlewareAuth(test.TestCase):
     async def test_edit_user_nonadmin(self):
         with self.assertRaises(HTTPException):
             await edit_user(self.user, self.admin.id, 'edited_name', 'test')
+
+    async def test_search_users_prefix(self):
+        await User.bulk_create([User(name=name, password='x') for name in ('tea', 'tester', 'toast', 'u')])
+        users = await search_user_rows(prefix='te')
+        self.assertEqual([user['name'] for user in users], ['tea', 'test', 'tester'])
+
+    async def test_search_users_role_and_pages(self):
+        await User.bulk_create([User(name=f'user{i}', password='x') for i in range(5)])
+        first = await search_user_rows(role='customer', limit=3)
+        second = await search_user_rows(role='customer', limit=3, after=first[-1]['name'])
+        self.assertEqual([user['name'] for user in first + second],
+                         ['test', 'user0', 'user1', 'user2', 'user3', 'user4'])
+        with self.assertRaises(HTTPException):
+            await search_user_rows(limit=0)
+
+    async def test_bulk_increment_credit(self):
+        other = await User.create(name='other', password='x', credit=50)
+        summary = await bulk_set_credit('increment', 100, [self.user.id, other.id, 999])
+        self.assertEqual(summary, {"updated": 2, "credited": 200, "missing": [999]})
+        self.assertEqual((await User.get(id=other.id)).credit, 150)
+        self.assertEqual((await User.get(id=other.id)).version, 1)
+
+    async def test_bulk_set_credit(self):
+        other = await User.create(name='other', password='x', credit=50)
+        with patch('shopen.middleware.auth.BULK_CREDIT_CHUNK', 1):
+            summary = await bulk_set_credit('set', 80, [self.user.id, other.id])
+        self.assertEqual(summary, {"updated": 2, "credited": 110, "missing": []})
+        entries = await LedgerEntry.filter(kind='credit').order_by('user_id').values_list('user_id', 'credit')
+        self.assertEqual(entries, [(self.user.id, 80), (other.id, 30)])
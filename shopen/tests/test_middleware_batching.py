@@ -0,0 +1,44 @@
+import asyncio
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.models.models import User, Transaction, TransactionLine
+from shopen.middleware.batching import WriteBatcher
+from shopen.middleware.pens import insert_transaction
+
+order = [{'penId': 1, 'number': 3}]
+
+
+class TestMiddlewareBatching(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.user = await User.create(name='test', password='test')
+
+    async def test_batch_assigns_ids(self):
+        batcher = WriteBatcher('test.batch', window=0.05, max_rows=3)
+        transactions = await asyncio.gather(*[
+            batcher.submit(lambda price=price: insert_transaction(self.user, price, order))
+            for price in range(5)])
+        self.assertEqual(len({t.id for t in transactions}), 5)
+        self.assertEqual([t.price for t in transactions], [0, 1, 2, 3, 4])
+        self.assertEqual(await Transaction.all().count(), 5)
+        self.assertEqual(await TransactionLine.all().count(), 5)
+
+    async def test_failed_write_isolated(self):
+        batcher = WriteBatcher('test.batch', window=0.01, max_rows=10)
+
+        async def broken():
+            raise ValueError('broken')
+
+        results = await asyncio.gather(
+            batcher.submit(lambda: insert_transaction(self.user, 1, order)),
+            batcher.submit(broken),
+            return_exceptions=True)
+        self.assertEqual(results[0].price, 1)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(await Transaction.all().count(), 1)
@@ -0,0 +1,41 @@
+import asyncio
+import json
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.broadcast import Broadcaster, broadcaster, stock_events
+
+
+class TestMiddlewareBroadcast(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    def test_coalesce_per_pen(self):
+        feed = Broadcaster()
+        subscriber = feed.subscribe()
+        feed.publish({'id': 1, 'stock': 10})
+        feed.publish({'id': 1, 'stock': 7})
+        feed.publish({'id': 2, 'stock': 3, 'deleted': True})
+        self.assertEqual(subscriber.drain(), [{'id': 1, 'stock': 7},
+                                              {'id': 2, 'stock': 3, 'deleted': True}])
+        self.assertEqual(subscriber.drain(), [])
+        feed.unsubscribe(subscriber)
+        self.assertEqual(len(feed.subscribers), 0)
+
+    async def test_stock_events(self):
+        async def snapshot():
+            return [{'id': 1, 'stock': 10}]
+
+        events = stock_events(snapshot, coalesce=0.01, keepalive=0.05)
+        self.assertIn('"stock": 10', await events.__anext__())
+        self.assertEqual(await events.__anext__(), ": keepalive\n\n")
+        pending = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0)
+        broadcaster.publish({'id': 1, 'stock': 9})
+        broadcaster.publish({'id': 1, 'stock': 8})
+        event = await pending
+        self.assertEqual(json.loads(event.split('data: ')[1]), [{'id': 1, 'stock': 8}])
+        await events.aclose()
+        self.assertEqual(len(broadcaster.subscribers), 0)
@@ -0,0 +1,67 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.models.models import User, Transaction
+from shopen.middleware.export import iter_transactions, export_transactions, gzip_stream
+from shopen.middleware.pens import archive_transactions
+
+order = [{'penId': 1, 'number': 3}]
+
+
+async def collect(chunks) -> bytes:
+    return b''.join([chunk async for chunk in chunks])
+
+
+class TestMiddlewareExport(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.user = await User.create(name='test', password='test')
+        for status in ['requested', 'completed', 'completed', 'refunded', 'completed']:
+            await Transaction.create(user=self.user, price=10, order=order, status=status)
+
+    async def test_chunks(self):
+        chunks = [chunk async for chunk in iter_transactions(chunk_size=2)]
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([row['id'] for chunk in chunks for row in chunk], [1, 2, 3, 4, 5])
+
+    async def test_filters(self):
+        rows = [row async for chunk in iter_transactions(status='completed') for row in chunk]
+        self.assertEqual(len(rows), 3)
+        future = datetime.now(timezone.utc) + timedelta(days=1)
+        rows = [row async for chunk in iter_transactions(start=future) for row in chunk]
+        self.assertEqual(rows, [])
+
+    async def test_csv(self):
+        body = await collect(export_transactions('csv', status='refunded'))
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0], ['id', 'userId', 'status', 'price', 'timestamp', 'order'])
+        self.assertEqual(rows[1][:4], ['4', str(self.user.id), 'refunded', '10.0'])
+        self.assertEqual(json.loads(rows[1][5]), order)
+
+    async def test_ndjson_gzip(self):
+        body = await collect(gzip_stream(export_transactions('ndjson')))
+        lines = gzip.decompress(body).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['order'], order)
+
+    async def test_archived(self):
+        old = datetime.now(timezone.utc) - timedelta(days=40)
+        await Transaction.filter(id__in=[1, 2]).update(timestamp=old)
+        self.assertEqual(await archive_transactions(), 1)
+        rows = [row async for chunk in iter_transactions(chunk_size=2) for row in chunk]
+        self.assertEqual([row['id'] for row in rows], [2, 1, 3, 4, 5])
+        rows = [row async for chunk in iter_transactions(start=old - timedelta(hours=1),
+                                                         end=old + timedelta(hours=1)) for row in chunk]
+        self.assertEqual([row['id'] for row in rows], [2, 1])
+        rows = [row async for chunk in iter_transactions(end=old) for row in chunk]
+        self.assertEqual(rows, [])
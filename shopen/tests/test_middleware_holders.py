@@ -0,0 +1,48 @@
+from fastapi import HTTPException
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.models.setup import set_default_stock, set_default_holders, migrate_holders
+from shopen.models.models import Holder
+from shopen.middleware.holders import list_holders, holders_by_pen
+
+
+class TestMiddlewareHolders(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.pens = await set_default_stock()
+        await set_default_holders(self.pens)
+
+    async def test_list_holders(self):
+        holders = await list_holders()
+        self.assertEqual([h['name'] for h in holders], ['holderMax', 'Thule', 'HELLo'])
+
+    async def test_filter_holders(self):
+        holders = await list_holders(pen_ids=[self.pens[0].id], min_capacity=20)
+        self.assertEqual([h['name'] for h in holders], ['Thule'])
+
+    async def test_paginate_holders(self):
+        holders = await list_holders(limit=1, offset=1)
+        self.assertEqual([h['name'] for h in holders], ['Thule'])
+        with self.assertRaises(HTTPException):
+            await list_holders(limit=0)
+
+    async def test_holders_by_pen(self):
+        ids = [pen.id for pen in self.pens[:3]]
+        grouped = await holders_by_pen(ids)
+        self.assertEqual([len(grouped[pen_id]) for pen_id in ids], [2, 0, 1])
+        self.assertEqual(grouped[ids[2]][0], {'id': 3, 'penId': ids[2], 'name': 'HELLo', 'capacity': 666})
+
+    async def test_migrate_holders(self):
+        await Holder.all().delete()
+        await migrate_holders()
+        holders = await list_holders()
+        self.assertEqual([(h['pen_id'], h['name']) for h in holders],
+                         [(self.pens[0].id, 'holderMax'), (self.pens[0].id, 'Thule'), (self.pens[2].id, 'HELLo')])
+        await migrate_holders()
+        self.assertEqual(await Holder.all().count(), 3)
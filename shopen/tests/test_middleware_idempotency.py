@@ -0,0 +1,66 @@
+import asyncio
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from shopen.middleware.idempotency import IdempotencyStore, idempotent, store, REPLAY_HEADER
+
+
+class TestMiddlewareIdempotency(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        store.clear()
+        finalizer()
+
+    async def test_replay_without_execution(self):
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return JSONResponse(status_code=201, content={"id": len(calls)})
+
+        responses = await asyncio.gather(*[idempotent('key', 'scope', handler) for _ in range(3)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({r.body for r in responses}, {b'{"id":1}'})
+        self.assertEqual(responses[-1].headers[REPLAY_HEADER], 'true')
+
+    async def test_errors_are_not_stored(self):
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            return JSONResponse(status_code=400, content={"message": "Not enough credit"})
+
+        await idempotent('key', 'scope', handler)
+        await idempotent('key', 'scope', handler)
+        self.assertEqual(len(calls), 2)
+
+    async def test_different_body_rejected(self):
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            return JSONResponse(status_code=201, content={"id": len(calls)})
+
+        await idempotent('key', 'scope', handler, b'{"order": [{"id": 1, "count": 1}]}')
+        with self.assertRaises(HTTPException) as raised:
+            await idempotent('key', 'scope', handler, b'{"order": [{"id": 2, "count": 1}]}')
+        self.assertEqual(raised.exception.status_code, 422)
+        replayed = await idempotent('key', 'scope', handler, b'{"order": [{"id": 1, "count": 1}]}')
+        self.assertEqual(replayed.headers[REPLAY_HEADER], 'true')
+        self.assertEqual(len(calls), 1)
+
+    def test_store_bounded(self):
+        bounded = IdempotencyStore(size=2, ttl=60)
+        for key in 'abc':
+            bounded.put(key, 200, b'{}')
+        self.assertEqual(len(bounded), 2)
+        self.assertIsNone(bounded.get('a'))
+
+    def test_store_ttl(self):
+        expiring = IdempotencyStore(size=2, ttl=-1)
+        expiring.put('a', 200, b'{}')
+        self.assertIsNone(expiring.get('a'))
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.models.setup import set_default_users
+from shopen.models.models import Pen, User, LedgerEntry, DailyRevenue
+from shopen.models.schemas import PenRequest, TransactionRequest
+from shopen.middleware.pens import request_pens, complete_transaction, refund_transaction, restock_pen, \
+    add_pen, delete_pen
+from shopen.middleware.ledger import get_user_spend, get_pen_sales, list_daily_revenue
+
+
+class TestMiddlewareLedger(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.admin = await set_default_users()
+        self.user = await User.create(name='test', password='test', credit=1000)
+        self.pen = await Pen.create(brand='space', price=10, stock=1000, color='blue', length=5)
+
+    async def buy(self, count: int):
+        invoice = TransactionRequest(order=[PenRequest(id=self.pen.id, count=count)])
+        transaction = await request_pens(self.user, invoice)
+        await complete_transaction(self.user, transaction.id)
+        return transaction
+
+    async def test_purchase_aggregates(self):
+        await self.buy(3)
+        await self.buy(2)
+        spend = await get_user_spend(self.user.id)
+        self.assertEqual(spend.spent, 50)
+        self.assertEqual(spend.transactions, 2)
+        self.assertEqual((await get_pen_sales(self.pen.id)).units, 5)
+        days = await list_daily_revenue()
+        self.assertEqual(days[0].day, datetime.now(timezone.utc).date())
+        self.assertEqual(days[0].revenue, 50)
+        self.assertEqual(await LedgerEntry.filter(kind='purchase').count(), 4)
+
+    async def test_refund_aggregates(self):
+        transaction = await self.buy(3)
+        await refund_transaction(self.user, transaction.id)
+        spend = await get_user_spend(self.user.id)
+        self.assertEqual(spend.spent, 0)
+        self.assertEqual(spend.transactions, 0)
+        self.assertEqual((await get_pen_sales(self.pen.id)).units, 0)
+        self.assertEqual(await LedgerEntry.filter(kind='refund').count(), 2)
+
+    async def test_refund_multi_line_order(self):
+        other = await Pen.create(brand='space', price=5, stock=1000)
+        invoice = TransactionRequest(order=[PenRequest(id=self.pen.id, count=1), PenRequest(id=other.id, count=2)])
+        transaction = await request_pens(self.user, invoice)
+        await complete_transaction(self.user, transaction.id)
+        await refund_transaction(self.user, transaction.id)
+        spend = await get_user_spend(self.user.id)
+        self.assertEqual((spend.spent, spend.transactions), (0, 0))
+        self.assertEqual([(day.revenue, day.transactions) for day in await list_daily_revenue()], [(0, 0)])
+
+    async def test_refund_booked_on_purchase_day(self):
+        transaction = await self.buy(3)
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+        await LedgerEntry.filter(kind='purchase').update(timestamp=yesterday)
+        await DailyRevenue.all().delete()
+        await DailyRevenue.create(day=yesterday.date(), revenue=30, transactions=1)
+        await refund_transaction(self.user, transaction.id)
+        days = await list_daily_revenue()
+        self.assertEqual([(day.day, day.revenue, day.transactions) for day in days], [(yesterday.date(), 0, 0)])
+
+    async def test_restock_entry(self):
+        await restock_pen(self.admin, self.pen.id, 5)
+        entry = await LedgerEntry.get(kind='restock')
+        self.assertEqual(entry.pen_id, self.pen.id)
+        self.assertEqual(entry.stock, 5)
+
+    async def test_empty_aggregates(self):
+        spend = await get_user_spend(12345)
+        self.assertEqual(spend.spent, 0)
+        self.assertEqual((await get_pen_sales(12345)).units, 0)
+
+    async def test_stock_follows_ledger(self):
+        pen = await add_pen(self.admin, 'space', 10, 50)
+        await restock_pen(self.admin, pen.id, 5)
+        self.pen = pen
+        transaction = await self.buy(3)
+        await refund_transaction(self.user, transaction.id)
+        await self.buy(2)
+        await pen.refresh_from_db()
+        self.assertEqual(sum(await LedgerEntry.filter(pen_id=pen.id).values_list('stock', flat=True)), pen.stock)
+        await delete_pen(self.admin, pen.id)
+        self.assertEqual(sum(await LedgerEntry.filter(pen_id=pen.id).values_list('stock', flat=True)), 0)
+        self.assertEqual(await LedgerEntry.filter(pen_id=pen.id, kind__in=['initial', 'removal'])
+                         .order_by('id').values_list('kind', 'stock'), [('initial', 50), ('removal', -53)])
@@ -0,0 +1,50 @@
+import json
+from datetime import datetime, timedelta, timezone
+import httpx
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.main import app
+from shopen.models.models import User, Session
+from shopen.settings import MAX_BODY_BYTES, MAX_BULK_CREDIT_USERS
+
+
+class TestMiddlewareLimits(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await super().asyncTearDown()
+
+    async def test_content_length(self):
+        response = await self.client.post('/api/v1/users/login', content=b'x' * (MAX_BODY_BYTES + 1))
+        self.assertEqual(response.status_code, 413)
+
+    async def test_streamed_without_content_length(self):
+        async def chunks():
+            for _ in range(MAX_BODY_BYTES // 8192 + 2):
+                yield b'x' * 8192
+
+        response = await self.client.post('/api/v1/users/login', content=chunks())
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json(), {"message": f"Request body is larger than {MAX_BODY_BYTES} bytes"})
+
+    async def test_largest_bulk_credit(self):
+        admin = await User.create(name='admin', password='admin', role='admin')
+        await Session.create(user=admin, token='admin_token', expiry=datetime.now(timezone.utc) + timedelta(days=1))
+        # ten digit ids are the widest sqlite integer keys a shop will reach
+        ids = [1_000_000_000 + i for i in range(MAX_BULK_CREDIT_USERS)]
+        await User.bulk_create([User(id=user_id, name=f'user{user_id}', password='test') for user_id in ids])
+        body = json.dumps({'operation': 'increment', 'amount': 5, 'users': ids}).encode()
+        self.assertGreater(len(body), MAX_BODY_BYTES)
+        response = await self.client.post('/api/v1/users/credit', content=body,
+                                          headers={'Authorization': 'admin_token', 'Content-Type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], MAX_BULK_CREDIT_USERS)
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+from fastapi import HTTPException
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.outbox import outbox, Outbox, QueueSink, FileSink, WebhookSink, sink_from_setting
+from shopen.middleware.pens import request_pens, complete_transaction, restock_pen
+from shopen.models.models import OutboxEvent, Pen, User
+from shopen.models.schemas import TransactionRequest
+
+
+class FailingSink:
+    async def deliver(self, events):
+        raise ConnectionError("warehouse is down")
+
+
+class TestMiddlewareOutbox(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def test_disabled(self):
+        await Outbox().emit('pen.deleted', {'penId': 1})
+        self.assertEqual(await OutboxEvent.all().count(), 0)
+
+    async def test_sink_from_setting(self):
+        self.assertIsNone(sink_from_setting(''))
+        self.assertIsInstance(sink_from_setting('queue'), QueueSink)
+        self.assertEqual(sink_from_setting('webhook:http://localhost:9000/events').url,
+                         'http://localhost:9000/events')
+        with self.assertRaises(ValueError):
+            sink_from_setting('kafka:events')
+
+    async def test_dispatch_in_batches(self):
+        sink = QueueSink()
+        box = Outbox(sink, batch=2)
+        for pen_id in range(5):
+            await box.emit('pen.deleted', {'penId': pen_id})
+        self.assertEqual(await box.dispatch(), 5)
+        self.assertEqual([sink.queue.get_nowait()['payload']['penId'] for _ in range(5)], [0, 1, 2, 3, 4])
+        self.assertEqual(await box.dispatch(), 0)
+
+    async def test_failed_delivery_backs_off(self):
+        box = Outbox(FailingSink())
+        await box.emit('pen.deleted', {'penId': 1})
+        self.assertEqual(await box.dispatch(), 0)
+        event = await OutboxEvent.get()
+        self.assertFalse(event.delivered)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('warehouse is down', event.last_error)
+        self.assertIsNotNone(event.next_attempt_at)
+        # not due yet, so a working sink does not see it either
+        box.sink = QueueSink()
+        self.assertEqual(await box.dispatch(), 0)
+
+    async def test_file_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.jsonl')
+            box = Outbox(FileSink(path))
+            await box.emit('pen.deleted', {'penId': 1})
+            await box.emit('pen.deleted', {'penId': 2})
+            await box.dispatch()
+            with open(path) as file:
+                self.assertEqual([json.loads(line)['payload'] for line in file], [{'penId': 1}, {'penId': 2}])
+
+    async def test_webhook_sink(self):
+        received = []
+
+        class Stub(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Stub)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            box = Outbox(WebhookSink(f'http://127.0.0.1:{server.server_port}/events'))
+            await box.emit('pen.deleted', {'penId': 1})
+            self.assertEqual(await box.dispatch(), 1)
+        finally:
+            server.shutdown()
+        self.assertEqual(received[0]['events'][0]['kind'], 'pen.deleted')
+
+    async def test_domain_events(self):
+        admin = await User.create(name='admin', password='admin', role='admin')
+        user = await User.create(name='test', password='test', credit=1000)
+        pen = await Pen.create(brand='space', price=10, stock=1000)
+        with patch.object(outbox, 'sink', QueueSink()):
+            await restock_pen(admin, pen.id, 5)
+            transaction = await request_pens(user, TransactionRequest(order=[{'id': pen.id, 'count': 3}]))
+            await complete_transaction(user, transaction.id)
+        events = await OutboxEvent.all().order_by('id')
+        self.assertEqual([event.kind for event in events], ['pen.restocked', 'transaction.completed'])
+        self.assertEqual(events[1].payload, {'transactionId': transaction.id, 'userId': user.id, 'amount': 30.0,
+                                             'order': [{'penId': pen.id, 'number': 3}]})
+
+    async def test_no_event_on_rollback(self):
+        user = await User.create(name='test', password='test', credit=1000)
+        pen = await Pen.create(brand='space', price=10, stock=1000)
+        transaction = await request_pens(user, TransactionRequest(order=[{'id': pen.id, 'count': 3}]))
+        await User.filter(id=user.id).update(credit=0)
+        await user.refresh_from_db()
+        with patch.object(outbox, 'sink', QueueSink()):
+            with self.assertRaises(HTTPException):
+                await complete_transaction(user, transaction.id)
+        self.assertEqual(await OutboxEvent.all().count(), 0)
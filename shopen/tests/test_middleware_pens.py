@@ -1,12 +1,18 @@
 from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
 from fastapi import HTTPException
 from tortoise.contrib import test
 from tortoise.contrib.test import initializer, finalizer
-from shopen.models.setup import set_default_users
-from shopen.models.models import Pen, User, Transaction
+from shopen.models.setup import set_default_users, migrate_transaction_lines
+from shopen.models.models import Pen, User, Transaction, TransactionLine, ArchivedTransactionLine
 from shopen.models.schemas import PenRequest, TransactionRequest
 from shopen.middleware.pens import list_pens, get_pen, add_pen, restock_pen, delete_pen, get_transaction, \
-    list_transactions, request_pens, cancel_transaction, refund_transaction
+    list_transactions, request_pens, cancel_transaction, refund_transaction, \
+    list_pen_rows, list_transaction_rows, PEN_FIELDS, TRANSACTION_FIELDS, \
+    count_expired_transactions, expire_transactions, complete_transaction, archive_transactions, \
+    quote_pens
+from shopen.middleware.catalogue import pen_snapshot
+from shopen.middleware.reservations import reservations
 
 order = [{'penId': 1, 'number': 3}]
 
@@ -31,6 +37,11 @@ class TestMiddlewareAuth(test.TestCase):
         self.assertEqual(len(pens), 1)
         self.assertEqual(pens[0].brand, 'space')
 
+    async def test_list_pen_rows(self):
+        await Pen.create(brand='lamy', price=20, stock=3)
+        pens = await list_pens()
+        self.assertEqual(await list_pen_rows(), [{field: getattr(pen, field) for field in PEN_FIELDS} for pen in pens])
+
     async def test_filter_pens_brand(self):
         pens = await list_pens(brand=['space'])
         self.assertEqual(len(pens), 1)
@@ -110,6 +121,14 @@ class TestMiddlewareAuth(test.TestCase):
         self.assertEqual(len(transactions), 1)
         self.assertEqual(transactions[0].price, 1.2)
 
+    async def test_list_transaction_rows(self):
+        await Transaction.create(user=self.user, price=1.2, order=order, status='completed')
+        await Transaction.create(user=self.admin, price=1.3, order=order)
+        for user, show_own in ((self.user, True), (self.admin, False)):
+            transactions = await list_transactions(user, show_own=show_own)
+            self.assertEqual(await list_transaction_rows(user, show_own=show_own),
+                             [{field: getattr(t, field) for field in TRANSACTION_FIELDS} for t in transactions])
+
     async def test_list_transactions_user_not_own(self):
         user = await User.create(name='test3', password='test3')
         await Transaction.create(user=user, price=1.3, order=order)
@@ -207,3 +226,113 @@ class TestMiddlewareAuth(test.TestCase):
             list_payloads.append(transaction)
 
         self.assertEqual(type(list_payloads), list)
+
+    async def test_expire_transactions(self):
+        stale = await Transaction.create(user=self.user, price=10, order=order)
+        await Transaction.filter(id=stale.id).update(timestamp=datetime.now(timezone.utc) - timedelta(hours=1))
+        fresh = await Transaction.create(user=self.user, price=10, order=order)
+        self.assertEqual(await count_expired_transactions(), 1)
+        self.assertEqual(await expire_transactions(batch_size=1), 1)
+        self.assertEqual((await Transaction.get(id=stale.id)).status, 'cancelled')
+        self.assertEqual((await Transaction.get(id=fresh.id)).status, 'requested')
+        self.assertEqual(await count_expired_transactions(), 0)
+
+    async def test_complete_and_refund_once(self):
+        # a racing request loaded the transaction before the first one changed its status
+        invoice = TransactionRequest(order=[PenRequest(id=self.pen.id, count=1)])
+        transaction = await request_pens(self.user, invoice)
+        stale = await Transaction.get(id=transaction.id)
+        await complete_transaction(self.user, transaction.id)
+        with patch('shopen.middleware.pens.get_transaction', return_value=stale):
+            with self.assertRaises(HTTPException):
+                await complete_transaction(self.user, transaction.id)
+        self.assertEqual((await User.get(id=self.user.id)).credit, 990)
+        self.assertEqual((await get_pen(self.pen.id)).stock, 999)
+        self.assertEqual((await Transaction.get(id=transaction.id)).status, 'completed')
+
+        stale = await Transaction.get(id=transaction.id)
+        await refund_transaction(self.user, transaction.id)
+        with patch('shopen.middleware.pens.get_transaction', return_value=stale):
+            with self.assertRaises(HTTPException):
+                await refund_transaction(self.user, transaction.id)
+        self.assertEqual((await User.get(id=self.user.id)).credit, 1000)
+        self.assertEqual((await get_pen(self.pen.id)).stock, 1000)
+
+    async def test_request_pen_reservation(self):
+        invoice = TransactionRequest(order=[
+            PenRequest(id=self.pen.id, count=60)])
+        with patch('shopen.middleware.pens.STOCK_RESERVATION', True):
+            try:
+                self.pen.stock = 100
+                await self.pen.save()
+                first = await request_pens(self.user, invoice)
+                self.assertEqual(reservations.held(self.pen.id), 60)
+                with self.assertRaises(HTTPException):
+                    await request_pens(self.user, invoice)
+                await Transaction.filter(id=first.id).update(status='cancelled')
+                reservations.release(first.id)
+                self.assertEqual(reservations.held(self.pen.id), 0)
+                second = await request_pens(self.user, invoice)
+                await complete_transaction(self.user, second.id)
+                self.assertEqual((await get_pen(self.pen.id)).stock, 40)
+                self.assertNotIn(second.id, reservations)
+            finally:
+                reservations.clear()
+
+    async def test_request_pen_lines(self):
+        invoice = TransactionRequest(order=[
+            PenRequest(id=self.pen.id, count=3)])
+        transaction = await request_pens(self.user, invoice)
+        self.assertEqual(transaction.order, [{'penId': self.pen.id, 'number': 3}])
+        lines = await TransactionLine.filter(transaction_id=transaction.id)
+        self.assertEqual([(line.pen_id, line.number) for line in lines], [(self.pen.id, 3)])
+        await complete_transaction(self.user, transaction.id)
+        self.assertEqual((await get_pen(self.pen.id)).stock, 997)
+
+    async def test_migrate_transaction_lines(self):
+        transaction = await Transaction.create(user=self.user, price=10, order=order)
+        await Transaction.create(user=self.user, price=10, order=[1, 2, 3])
+        self.assertEqual(await migrate_transaction_lines(batch_size=1), 2)
+        lines = await TransactionLine.filter(transaction_id=transaction.id)
+        self.assertEqual([(line.pen_id, line.number) for line in lines], [(1, 3)])
+        self.assertEqual(await migrate_transaction_lines(), 0)
+        await Transaction.create(user=self.user, price=10, order=order)
+        self.assertEqual(await migrate_transaction_lines(), 0)
+
+    async def test_archive_transactions(self):
+        old = datetime.now(timezone.utc) - timedelta(days=40)
+        done = await Transaction.create(user=self.user, price=10, order=order, status='completed')
+        await TransactionLine.create(transaction=done, pen_id=1, number=3)
+        pending = await Transaction.create(user=self.user, price=10, order=order)
+        recent = await Transaction.create(user=self.user, price=10, order=order, status='completed')
+        await Transaction.filter(id__in=[done.id, pending.id]).update(timestamp=old)
+        self.assertEqual(await archive_transactions(batch_size=1), 1)
+        self.assertFalse(await Transaction.exists(id=done.id))
+        self.assertTrue(await Transaction.exists(id=recent.id))
+        archived = await get_transaction(self.user, done.id)
+        self.assertEqual(archived.month, old.strftime('%Y-%m'))
+        self.assertEqual(archived.order, order)
+        self.assertEqual((await archived.user).id, self.user.id)
+        lines = await ArchivedTransactionLine.filter(transaction_id=done.id)
+        self.assertEqual([(line.pen_id, line.number) for line in lines], [(1, 3)])
+        self.assertFalse(await TransactionLine.exists(transaction_id=done.id))
+        listed = await list_transaction_rows(self.user)
+        self.assertEqual({row['id'] for row in listed}, {done.id, pending.id, recent.id})
+        with self.assertRaises(HTTPException):
+            await refund_transaction(self.user, done.id)
+
+    async def test_quote_pens(self):
+        invoice = TransactionRequest(order=[
+            PenRequest(id=self.pen.id, count=3)])
+        pen_snapshot.invalidate()
+        quote = await quote_pens(self.admin, invoice)
+        self.assertEqual(quote['subtotal'], 30)
+        self.assertEqual(quote['price'], 24)
+        self.assertTrue(quote['available'])
+        self.assertFalse(quote['enoughCredit'])
+        self.assertEqual(await Transaction.all().count(), 0)
+        quote = await quote_pens(self.user, TransactionRequest(order=[
+            PenRequest(id=self.pen.id, count=1001)]))
+        self.assertFalse(quote['lines'][0]['available'])
+        with self.assertRaises(HTTPException):
+            await quote_pens(self.user, TransactionRequest(order=[PenRequest(id=999, count=1)]))
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import httpx
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.main import app
+from shopen.middleware.plans import plan_guard, full_scans, HOT_ENDPOINTS, HotEndpoint
+from shopen.middleware.slowlog import install_connections
+from shopen.models.models import Pen, User, Session
+
+
+class TestMiddlewarePlans(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+        plan_guard.clear()
+
+    def tearDown(self):
+        plan_guard.clear()
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        install_connections()
+        user = await User.create(name='test', password='test', credit=1000)
+        await Session.create(user=user, token='user_token', expiry=datetime.now(timezone.utc) + timedelta(days=1))
+        await Pen.bulk_create([Pen(brand='space', price=10, stock=1000) for _ in range(3)])
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test',
+                                        headers={'Authorization': 'user_token'})
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await super().asyncTearDown()
+
+    async def checkout(self) -> None:
+        self.assertEqual((await self.client.get('/api/v1/users/me')).status_code, 200)
+        self.assertEqual((await self.client.get('/api/v1/pens')).status_code, 200)
+        self.assertEqual((await self.client.get('/api/v1/pens', params={'include': 'holders'})).status_code, 200)
+        order = {'order': [{'id': 1, 'count': 2}, {'id': 2, 'count': 1}]}
+        self.assertEqual((await self.client.post('/api/v1/transactions/quote', json=order)).status_code, 200)
+        response = await self.client.post('/api/v1/transactions/request', json=order)
+        self.assertEqual(response.status_code, 201)
+        transaction_id = response.json()['id']
+        response = await self.client.post(f'/api/v1/transactions/{transaction_id}/complete')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.client.get('/api/v1/transactions')).status_code, 200)
+
+    def test_full_scans(self):
+        self.assertEqual(full_scans(['SCAN pen', 'SEARCH user USING INDEX idx (name=?)',
+                                     'SCAN transaction USING INDEX idx_status', 'USE TEMP B-TREE FOR ORDER BY']),
+                         {'pen'})
+
+    async def test_hot_endpoints_within_budget(self):
+        await self.checkout()
+        self.assertEqual(list(plan_guard.violations), [])
+        self.assertEqual(set(plan_guard.last), set(HOT_ENDPOINTS))
+
+    async def test_extra_query_fails(self):
+        budgets = {**HOT_ENDPOINTS, 'GET /api/v1/users/me': HotEndpoint(2)}
+        with patch.object(plan_guard, 'endpoints', budgets):
+            await self.client.get('/api/v1/users/me')
+        self.assertEqual([v['problem'] for v in plan_guard.violations], ['3 queries, expected at most 2'])
+
+    async def test_extra_query_per_line_fails(self):
+        complete = 'POST /api/v1/transactions/{transaction_id}/complete'
+        budgets = {**HOT_ENDPOINTS, complete: HotEndpoint(HOT_ENDPOINTS[complete].queries - 1, per_line=4)}
+        with patch.object(plan_guard, 'endpoints', budgets):
+            await self.checkout()
+        self.assertEqual([v['endpoint'] for v in plan_guard.violations], [complete])
+
+    async def test_table_scan_fails(self):
+        budgets = {**HOT_ENDPOINTS, 'GET /api/v1/pens': HotEndpoint(2)}
+        with patch.object(plan_guard, 'endpoints', budgets):
+            await self.client.get('/api/v1/pens')
+        self.assertEqual([v['problem'] for v in plan_guard.violations], ['full scan of pen'])
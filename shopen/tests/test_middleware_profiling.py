@@ -0,0 +1,42 @@
+import asyncio
+import time
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware import metrics
+from shopen.middleware.profiling import LoopMonitor, sample_profile, lag_bucket
+
+
+class TestMiddlewareProfiling(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+        metrics.reset()
+
+    def tearDown(self):
+        finalizer()
+
+    async def test_lag_bucket(self):
+        self.assertEqual(lag_bucket(0.001), 'le_0.005')
+        self.assertEqual(lag_bucket(0.2), 'le_0.25')
+        self.assertEqual(lag_bucket(60), 'le_inf')
+
+    async def test_blocking_call_reported(self):
+        monitor = LoopMonitor(interval=0.01, threshold=0.05)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.03)
+            time.sleep(0.2)
+            await asyncio.sleep(0.03)
+        finally:
+            await monitor.stop()
+        self.assertEqual(len(monitor.blocked), 1)
+        self.assertIn('test_blocking_call_reported', monitor.blocked[0]['stack'])
+        summary = metrics.snapshot()['summaries']['event_loop.lag_seconds']
+        self.assertGreaterEqual(summary['max'], 0.1)
+
+    async def test_sample_profile(self):
+        profile = await sample_profile(0.05, 0.005)
+        lines = profile.splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn(';', stack)
+        self.assertGreater(int(count), 0)
@@ -0,0 +1,27 @@
+import contextvars
+from unittest.mock import patch
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.routing import read_db, use_primary
+
+
+class TestMiddlewareRouting(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    def test_unconfigured_read_connection(self):
+        with patch('shopen.middleware.routing.DB_READ_CONNECTIONS', ['read_0']):
+            self.assertIsNone(read_db())
+
+    def test_primary_only(self):
+        def route():
+            use_primary()
+            return read_db()
+
+        with patch('shopen.middleware.routing.DB_READ_CONNECTIONS', ['models']):
+            self.assertIsNotNone(read_db())
+            self.assertIsNone(contextvars.copy_context().run(route))
+            self.assertIsNotNone(read_db())
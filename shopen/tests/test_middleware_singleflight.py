@@ -0,0 +1,54 @@
+import asyncio
+from fastapi import HTTPException
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.singleflight import SingleFlight
+
+
+class TestMiddlewareSingleFlight(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def test_share_result(self):
+        flight = SingleFlight('test.reads')
+        calls = []
+
+        async def query():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ['pen']
+
+        results = await asyncio.gather(*[flight.do('key', query) for _ in range(5)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['pen']] * 5)
+        self.assertEqual((flight.executed, flight.shared), (1, 4))
+        self.assertEqual(len(flight), 0)
+        await flight.do('key', query)
+        self.assertEqual(len(calls), 2)
+
+    async def test_share_error(self):
+        flight = SingleFlight('test.reads')
+
+        async def query():
+            await asyncio.sleep(0.01)
+            raise HTTPException(status_code=404, detail="Pen not found")
+
+        results = await asyncio.gather(flight.do('key', query), flight.do('key', query),
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(r, HTTPException) for r in results))
+
+    async def test_cancelled_caller(self):
+        flight = SingleFlight('test.reads')
+
+        async def query():
+            await asyncio.sleep(0.01)
+            return 1
+
+        first = asyncio.ensure_future(flight.do('key', query))
+        second = asyncio.ensure_future(flight.do('key', query))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, 1)
@@ -0,0 +1,41 @@
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.slowlog import slow_queries, install_connections, normalise, _scope
+from shopen.models.models import Pen
+from shopen.models.setup import set_default_stock
+
+
+class TestMiddlewareSlowLog(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+        self.threshold = slow_queries.threshold
+        slow_queries.clear()
+
+    def tearDown(self):
+        slow_queries.threshold = self.threshold
+        slow_queries.clear()
+        finalizer()
+
+    async def test_normalise(self):
+        self.assertEqual(normalise('SELECT *\n  FROM "pen" WHERE "id" IN (?,?, ?)'),
+                         'SELECT * FROM "pen" WHERE "id" IN (?, ...)')
+
+    async def test_slow_query_recorded(self):
+        await set_default_stock()
+        install_connections()
+        slow_queries.threshold = 0
+        _scope.set({'method': 'GET', 'path': '/api/v1/pens'})
+        await Pen.filter(id__in=[1, 2]).values('id')
+        await Pen.filter(id__in=[3, 4, 5]).values('id')
+        entries = [e for e in slow_queries.top() if 'IN (?, ...)' in e['sql']]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['count'], 2)
+        self.assertEqual(entries[0]['endpoints'], [{'endpoint': 'GET /api/v1/pens', 'count': 2}])
+        self.assertTrue(any('pen' in step for step in entries[0]['plan']))
+        self.assertEqual(entries[0]['lastParams'], '[3, 4, 5]')
+
+    async def test_fast_query_ignored(self):
+        install_connections()
+        slow_queries.threshold = 60
+        await Pen.all().values('id')
+        self.assertEqual(slow_queries.top(), [])
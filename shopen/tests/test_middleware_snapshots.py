@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import tempfile
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.snapshots import save_snapshot, restore_snapshot
+from shopen.models.models import Pen
+
+
+# no wrapping transaction: a snapshot waits for the connection lock that it would hold
+class TestMiddlewareSnapshots(test.TruncationTestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.sqlite3')
+
+    def tearDown(self):
+        finalizer()
+        self.directory.cleanup()
+
+    async def test_save(self):
+        await Pen.create(brand='Pilot', price=10, stock=5)
+        await save_snapshot(self.path)
+        self.assertFalse(os.path.exists(f"{self.path}.partial"))
+        with sqlite3.connect(self.path) as db:
+            self.assertEqual(db.execute('SELECT brand, stock FROM pen').fetchall(), [('Pilot', 5)])
+
+    async def test_restore(self):
+        pen = await Pen.create(brand='Pilot', price=10, stock=5)
+        await save_snapshot(self.path)
+        await Pen.filter(id=pen.id).update(stock=0)
+        await Pen.create(brand='Bic', price=1, stock=1)
+        self.assertTrue(await restore_snapshot(self.path))
+        self.assertEqual(await Pen.all().values_list('brand', 'stock'), [('Pilot', 5)])
+
+    async def test_restore_missing(self):
+        await Pen.create(brand='Pilot', price=10, stock=5)
+        self.assertFalse(await restore_snapshot(self.path))
+        self.assertEqual(await Pen.all().count(), 1)
@@ -0,0 +1,62 @@
+from fastapi import HTTPException
+from tortoise.contrib import test
+from tortoise.contrib.test import initializer, finalizer
+from shopen.middleware.versioning import swap, retry_stale, StaleVersion
+from shopen.middleware.pens import restock_pen
+from shopen.middleware.auth import set_user_credit
+from shopen.models.models import Pen, User
+
+
+class TestMiddlewareVersioning(test.TestCase):
+    def setUp(self):
+        initializer(['shopen.models.models'], db_url='sqlite://:memory:')
+
+    def tearDown(self):
+        finalizer()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.admin = await User.create(name='admin', password='admin', role='admin')
+        self.pen = await Pen.create(brand='Pilot', price=15.0, stock=100)
+
+    async def test_swap(self):
+        await swap(self.pen, stock=90)
+        self.assertEqual((self.pen.stock, self.pen.version), (90, 1))
+        pen = await Pen.get(id=self.pen.id)
+        self.assertEqual((pen.stock, pen.version), (90, 1))
+
+    async def test_swap_stale(self):
+        stale = await Pen.get(id=self.pen.id)
+        await swap(self.pen, stock=90)
+        with self.assertRaises(StaleVersion):
+            await swap(stale, stock=110)
+        self.assertEqual((await Pen.get(id=self.pen.id)).stock, 90)
+
+    async def test_retry_refreshes(self):
+        stale = await Pen.get(id=self.pen.id)
+        await swap(self.pen, stock=90)
+        await retry_stale(lambda: swap(stale, stock=stale.stock + 10), stale)
+        pen = await Pen.get(id=self.pen.id)
+        self.assertEqual((pen.stock, pen.version), (100, 2))
+
+    async def test_retry_exhausted(self):
+        async def always_stale():
+            raise StaleVersion()
+
+        with self.assertRaises(HTTPException) as e:
+            await retry_stale(always_stale, attempts=2)
+        self.assertEqual(e.exception.status_code, 409)
+
+    async def test_restock_bumps_version(self):
+        for _ in range(3):
+            await restock_pen(self.admin, self.pen.id, 10)
+        pen = await Pen.get(id=self.pen.id)
+        self.assertEqual((pen.stock, pen.version), (130, 3))
+
+    async def test_set_credit_stale_user(self):
+        customer = await User.create(name='customer', password='customer')
+        stale = await User.get(id=customer.id)
+        await swap(customer, credit=50)
+        await set_user_credit(self.admin, stale, 200)
+        user = await User.get(id=customer.id)
+        self.assertEqual((user.credit, user.version), (200, 2))
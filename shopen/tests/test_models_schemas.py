@@ -0,0 +1,29 @@
+from unittest import TestCase
+from unittest.mock import patch
+from pydantic import ValidationError
+from shopen.models.schemas import TransactionRequest, BulkCredit
+
+
+class TestModelSchemas(TestCase):
+    def test_merge_duplicate_lines(self):
+        invoice = TransactionRequest(order=[{'id': 1, 'count': 2},
+                                            {'id': 2, 'count': 1},
+                                            {'id': 1, 'count': 3}])
+        self.assertEqual([(line.id, line.count) for line in invoice.order], [(1, 5), (2, 1)])
+
+    def test_line_cap(self):
+        with patch('shopen.models.schemas.MAX_ORDER_LINES', 2):
+            with self.assertRaises(ValidationError):
+                TransactionRequest(order=[{'id': i, 'count': 1} for i in range(3)])
+            self.assertEqual(len(TransactionRequest(order=[{'id': i, 'count': 1} for i in range(2)]).order), 2)
+
+    def test_bulk_credit(self):
+        request = BulkCredit(operation='increment', amount=10, users=[3, 1, 3])
+        self.assertEqual(request.users, [3, 1])
+        with self.assertRaises(ValidationError):
+            BulkCredit(operation='multiply', amount=10, users=[1])
+        with self.assertRaises(ValidationError):
+            BulkCredit(operation='set', amount=-1, users=[1])
+        with patch('shopen.models.schemas.MAX_BULK_CREDIT_USERS', 2):
+            with self.assertRaises(ValidationError):
+                BulkCredit(operation='set', amount=1, users=[1, 2, 3])